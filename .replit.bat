@@ -1,5 +1,5 @@
 Este comando diz ao Replit para iniciar o servidor web usando o ficheiro bot.py
-run = "gunicorn bot:app"
+run = "gunicorn bot:app -k uvicorn.workers.UvicornWorker"
 
 [env]
 PYTHONUNBUFFERED = "1"
\ No newline at end of file
@@ -1,52 +1,237 @@
-import requests
+import asyncio
 import time
 import hashlib
 import json
-from config import SHOPEE_APP_ID, SHOPEE_SECRET
-
-def convert_shopee_links(links: list) -> list:
-    """Conecta-se à API da Shopee para converter links, um por um."""
-    converted_links = []
-    for link in links:
-        try:
-            api_url = "https://open-api.affiliate.shopee.com.br/graphql"
-            timestamp = int(time.time())
-            graphql_query = f'mutation{{generateShortLink(input:{{originUrl:"{link}"}}){{shortLink}}}}'
-            request_body = {"query": graphql_query}
-            body_str = json.dumps(request_body)
-            base_string = f"{str(SHOPEE_APP_ID)}{timestamp}{body_str}{SHOPEE_SECRET}"
-            signature = hashlib.sha256(base_string.encode('utf-8')).hexdigest()
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"SHA256 Credential={SHOPEE_APP_ID}, Timestamp={timestamp}, Signature={signature}"
-            }
-            response = requests.post(api_url, data=body_str, headers=headers)
-            response_data = response.json()
-            if 'data' in response_data and response_data.get('data', {}).get('generateShortLink', {}).get('shortLink'):
-                converted_links.append(response_data['data']['generateShortLink']['shortLink'])
-            else:
-                error_msg = response_data.get('errors', [{}])[0].get('message', 'Desconhecido')
-                print(f"Erro da API Shopee ao converter {link[:30]}...: {error_msg}")
-                converted_links.append(f"Erro ao converter o link.")
-        except Exception as e:
-            print(f"Exceção na conversão do link {link[:30]}...: {e}")
-            converted_links.append(f"Erro técnico ao processar o link.")
+import httpx
+from cache import TTLCache, PersistentTTLCache, normalize_url
+from produtos import product_key
+from metrics import shopee_latency, shopee_errors
+from config import (
+    SHOPEE_APP_ID, SHOPEE_SECRET, SHOPEE_API_URL,
+    SHOPEE_CONNECT_TIMEOUT, SHOPEE_READ_TIMEOUT, RESOLVE_TIMEOUT, SHOPEE_BATCH_SIZE,
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE,
+    CONVERSION_CACHE_FILE, CONVERSION_CACHE_MAX_SIZE, CONVERSION_CACHE_TTL, CONVERSION_CACHE_SAVE_INTERVAL, STATE_BACKEND,
+    RESOLVE_CACHE_MAX_SIZE, RESOLVE_CACHE_TTL, RESOLVE_NEGATIVE_TTL
+)
+
+# Usamos um User-Agent de um browser comum para evitar bloqueios ao seguir redirecionamentos
+BROWSER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# --- CLIENTE HTTP PARTILHADO ---
+# Um único httpx.AsyncClient mantém as ligações abertas (keep-alive) entre pedidos.
+# O cliente fica associado ao event loop em que foi criado, por isso é recriado se o loop mudar.
+_client = None
+_client_loop = None
+
+# Cache de links já convertidos, indexada pelo produto ou pelo URL de origem normalizado (carregada em setup_bot)
+# e gravada no disco no máximo a cada CONVERSION_CACHE_SAVE_INTERVAL segundos; com vários workers
+# (STATE_BACKEND=sqlite) todos gravam o mesmo ficheiro, juntando as entradas uns dos outros
+conversion_cache = PersistentTTLCache(
+    CONVERSION_CACHE_FILE, CONVERSION_CACHE_MAX_SIZE, CONVERSION_CACHE_TTL, CONVERSION_CACHE_SAVE_INTERVAL,
+    shared=STATE_BACKEND == "sqlite"
+)
+
+# Cache de redirecionamentos (link encurtado -> URL final) e resoluções em curso, para juntar pedidos iguais
+resolve_cache = TTLCache(RESOLVE_CACHE_MAX_SIZE, RESOLVE_CACHE_TTL)
+_resolve_in_flight = {}
+
+def get_client() -> httpx.AsyncClient:
+    """Devolve o cliente HTTP assíncrono partilhado, criando-o na primeira utilização."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SHOPEE_READ_TIMEOUT, connect=SHOPEE_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+        _client_loop = loop
+    return _client
+
+async def close_client() -> None:
+    """Fecha o cliente HTTP partilhado (usar ao desligar o bot)."""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+def _signed_headers(body_str: str) -> dict:
+    """Gera os cabeçalhos de autenticação SHA256 exigidos pela API de afiliados."""
+    timestamp = int(time.time())
+    base_string = f"{str(SHOPEE_APP_ID)}{timestamp}{body_str}{SHOPEE_SECRET}"
+    signature = hashlib.sha256(base_string.encode('utf-8')).hexdigest()
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"SHA256 Credential={SHOPEE_APP_ID}, Timestamp={timestamp}, Signature={signature}"
+    }
+
+# Mensagens de erro devolvidas no lugar do link convertido (os handlers procuram "Erro" no texto)
+ERRO_CONVERSAO = "Erro ao converter o link."
+ERRO_TECNICO = "Erro técnico ao processar o link."
+
+# Palavras que indicam que o documento foi rejeitado por ser demasiado grande ou complexo
+BATCH_SIZE_HINTS = ("too large", "too many", "complex", "depth", "size")
+
+class BatchRejectedError(Exception):
+    """A Shopee rejeitou o documento GraphQL inteiro (sem resultados por link)."""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def too_large(self) -> bool:
+        """True se a rejeição se deve ao tamanho do lote (e dividi-lo pode resolver)."""
+        if self.status_code == 413:
+            return True
+        if self.status_code == 429 or self.status_code in (401, 403) or self.status_code >= 500:
+            return False
+        message = str(self).lower()
+        return any(hint in message for hint in BATCH_SIZE_HINTS)
+
+def _build_batch_query(links: list) -> str:
+    """Junta várias mutações generateShortLink num só documento, uma por alias (l0, l1, ...)."""
+    # json.dumps produz uma string GraphQL válida e escapa aspas/barras presentes no URL
+    mutations = [
+        f'l{i}:generateShortLink(input:{{originUrl:{json.dumps(link)}}}){{shortLink}}'
+        for i, link in enumerate(links)
+    ]
+    return "mutation{" + " ".join(mutations) + "}"
+
+async def _convert_batch(client: httpx.AsyncClient, links: list) -> list:
+    """Envia um único pedido assinado para um lote de links e devolve os resultados na mesma ordem."""
+    body_str = json.dumps({"query": _build_batch_query(links)})
+    with shopee_latency.time("convert"):
+        response = await client.post(SHOPEE_API_URL, content=body_str, headers=_signed_headers(body_str))
+    try:
+        response_data = response.json()
+    except ValueError:
+        raise BatchRejectedError(f"HTTP {response.status_code}", response.status_code)
+
+    data = response_data.get('data') or {}
+    errors = response_data.get('errors') or []
+
+    # Erros com "path" pertencem a um alias concreto; os restantes afetam o documento todo
+    errors_by_alias = {}
+    global_errors = []
+    for error in errors:
+        path = error.get('path') or []
+        if path:
+            errors_by_alias[path[0]] = error.get('message', 'Desconhecido')
+        else:
+            global_errors.append(error.get('message', 'Desconhecido'))
+
+    if not data and (global_errors or response.status_code >= 400):
+        raise BatchRejectedError(global_errors[0] if global_errors else f"HTTP {response.status_code}", response.status_code)
+
+    results = []
+    for i, link in enumerate(links):
+        short_link = (data.get(f"l{i}") or {}).get('shortLink')
+        if short_link:
+            results.append(short_link)
+        else:
+            error_msg = errors_by_alias.get(f"l{i}") or (global_errors[0] if global_errors else 'Desconhecido')
+            print(f"Erro da API Shopee ao converter {link[:30]}...: {error_msg}")
+            results.append(ERRO_CONVERSAO)
+    return results
+
+async def _convert_with_fallback(client: httpx.AsyncClient, links: list) -> list:
+    """Converte um lote; se a Shopee o rejeitar por ser grande demais, divide-o ao meio e tenta de novo.
+
+    Outras rejeições (autenticação, limite de pedidos, erro do servidor) afetam todos os links por
+    igual, por isso o lote inteiro falha sem gerar mais pedidos.
+    """
+    try:
+        return await _convert_batch(client, links)
+    except BatchRejectedError as e:
+        shopee_errors.inc("convert")
+        if len(links) == 1 or not e.too_large:
+            print(f"Erro da API Shopee ao converter {len(links)} link(s): {e}")
+            return [ERRO_CONVERSAO] * len(links)
+        print(f"Lote de {len(links)} links rejeitado pela Shopee ({e}). A dividir em lotes menores...")
+        middle = len(links) // 2
+        return await _convert_with_fallback(client, links[:middle]) + await _convert_with_fallback(client, links[middle:])
+    except Exception as e:
+        shopee_errors.inc("convert")
+        print(f"Exceção na conversão de {len(links)} link(s): {e}")
+        return [ERRO_TECNICO] * len(links)
+
+async def convert_shopee_links(links: list) -> list:
+    """Converte links na API da Shopee, agrupando até SHOPEE_BATCH_SIZE mutações por pedido.
+
+    Os links já presentes na cache de conversões não geram nenhum pedido.
+    Devolve uma lista com o mesmo tamanho e ordem de `links`; os links que falharam
+    ficam com uma mensagem de erro na posição correspondente.
+    """
+    converted_links = [None] * len(links)
+    pending = {} # chave (produto ou URL normalizado) -> (link original, posições na lista)
+    for i, link in enumerate(links):
+        # Formatos de URL diferentes do mesmo produto partilham a conversão
+        key = product_key(link) or normalize_url(link)
+        if key in pending:
+            pending[key][1].append(i)
+            continue
+        cached = conversion_cache.get(key)
+        if cached is not None:
+            converted_links[i] = cached
+        else:
+            pending[key] = (link, [i])
+
+    if pending:
+        client = get_client()
+        keys = list(pending)
+        for start in range(0, len(keys), SHOPEE_BATCH_SIZE):
+            chunk = keys[start:start + SHOPEE_BATCH_SIZE]
+            results = await _convert_with_fallback(client, [pending[key][0] for key in chunk])
+            for key, result in zip(chunk, results):
+                if "Erro" not in result:
+                    conversion_cache.set(key, result)
+                for i in pending[key][1]:
+                    converted_links[i] = result
     return converted_links
 
-def resolve_short_link(url: str) -> str:
-    """Segue os redirecionamentos para encontrar o URL final e completo de um link encurtado."""
+async def _follow_redirects(url: str) -> str:
+    """Faz o pedido HEAD que segue os redirecionamentos e guarda o resultado (ou a falha) na cache."""
     try:
-        # Usamos um User-Agent de um browser comum para evitar bloqueios
-        session = requests.Session()
-        session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
         # Usamos .head() para ser mais rápido, pois só queremos o URL final, não o conteúdo da página
-        response = session.head(url, allow_redirects=True, timeout=10)
-        final_url = response.url
+        with shopee_latency.time("resolve"):
+            response = await get_client().head(
+                url,
+                headers={'User-Agent': BROWSER_USER_AGENT},
+                follow_redirects=True,
+                timeout=RESOLVE_TIMEOUT
+            )
+        final_url = str(response.url)
         print(f"Link {url} resolvido para {final_url}")
+        # Só um destino reconhecido fica em cache muito tempo; uma página de verificação anti-bot
+        # ou uma resposta de erro é provavelmente passageira e volta a ser tentada em breve
+        recognized = product_key(final_url) is not None or "/video/" in final_url.lower()
+        if response.status_code < 400 and recognized:
+            resolve_cache.set(url, final_url)
+        else:
+            resolve_cache.set(url, final_url, ttl=RESOLVE_NEGATIVE_TTL)
         return final_url
-    except requests.RequestException as e:
+    except (httpx.HTTPError, httpx.InvalidURL) as e:
+        shopee_errors.inc("resolve")
         print(f"Erro ao resolver o link {url}: {e}")
+        # Cache negativa: o mesmo link partido não volta a esperar pelo timeout durante algum tempo
+        resolve_cache.set(url, url, ttl=RESOLVE_NEGATIVE_TTL)
         return url # Em caso de erro, retorna o link original
 
+async def resolve_short_link(url: str) -> str:
+    """Segue os redirecionamentos para encontrar o URL final e completo de um link encurtado.
+
+    Usa a cache de redirecionamentos e junta resoluções simultâneas do mesmo link num único pedido.
+    """
+    url = url.strip()
+    cached = resolve_cache.get(url)
+    if cached is not None:
+        return cached
+
+    task = _resolve_in_flight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_follow_redirects(url))
+        _resolve_in_flight[url] = task
+        task.add_done_callback(lambda _: _resolve_in_flight.pop(url, None))
+    # shield: se um dos utilizadores à espera for cancelado, a resolução continua para os restantes
+    return await asyncio.shield(task)
@@ -0,0 +1,143 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from urllib.parse import parse_qs
+
+# --- SERVIDORES FALSOS PARA OS TESTES DE CARGA ---
+# Substitutos locais (ASGI) da Bot API do Telegram e da API GraphQL de afiliados da Shopee,
+# com latência e erros configuráveis. Nunca contactam os serviços reais.
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def _respond(send, status: int, payload: dict, headers=()) -> None:
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class FakeServer:
+    """Base comum: latência aleatória em torno de `latency` segundos e uma taxa de erros `error_rate`."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+
+    async def _delay(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+
+    def _should_fail(self) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["type"] == "http":
+            self.requests += 1
+            await self._delay()
+            await self.handle(scope, await _read_body(receive), send)
+
+class FakeTelegram(FakeServer):
+    """Bot API falsa: responde a getMe, sendMessage, sendPhoto e editMessageText.
+
+    Regista o instante da última resposta enviada a cada chat (`last_reply`) e o total de mensagens
+    por método, para o benchmark medir a latência de ponta a ponta. Os erros injetados são
+    respostas 429 (flood wait) e 500; os chats em `blocked` recebem sempre 403 (bot bloqueado).
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, retry_after: int = 1, blocked=()):
+        super().__init__(latency, error_rate)
+        self.retry_after = retry_after
+        self.blocked = set(blocked)
+        self.calls = {} # método -> número de chamadas com sucesso
+        self.last_reply = {} # chat_id -> time.perf_counter() da última mensagem enviada ou editada
+        self._message_id = 0
+
+    async def handle(self, scope, body: bytes, send) -> None:
+        method = scope["path"].rsplit("/", 1)[-1]
+        params = self._parse(scope, body)
+        if params.get("chat_id") and int(params["chat_id"]) in self.blocked:
+            await _respond(send, 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+            return
+        if method != "getMe" and self._should_fail():
+            if random.random() < 0.5:
+                await _respond(send, 429, {
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry later",
+                    "parameters": {"retry_after": self.retry_after},
+                })
+            else:
+                await _respond(send, 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"})
+            return
+
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method in ("sendMessage", "sendPhoto", "editMessageText"):
+            chat_id = int(params.get("chat_id", 0))
+            self.last_reply[chat_id] = time.perf_counter()
+            self._message_id += 1
+            result = {
+                "message_id": int(params.get("message_id") or self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text") or params.get("caption") or "",
+            }
+        else:
+            result = True
+        await _respond(send, 200, {"ok": True, "result": result})
+
+    @staticmethod
+    def _parse(scope, body: bytes) -> dict:
+        headers = dict(scope.get("headers") or [])
+        content_type = headers.get(b"content-type", b"").decode()
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            # Só precisamos de campos simples (chat_id, text, caption, message_id)
+            fields = re.findall(rb'name="([^"]+)"\r\n\r\n(.*?)\r\n--', body, re.S)
+            return {name.decode(): value.decode() for name, value in fields}
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+class FakeShopee(FakeServer):
+    """API de afiliados falsa: converte cada alias `l<i>` de um lote GraphQL num shortLink determinístico.
+
+    Qualquer outro pedido (ex.: o HEAD usado para resolver links encurtados) recebe 200, ou seja,
+    o link já é o URL final. Os erros injetados são respostas 500 ao lote inteiro.
+    """
+
+    ALIAS_PATTERN = re.compile(r'(l\d+)\s*:\s*generateShortLink\(\s*input\s*:\s*\{\s*originUrl\s*:\s*("(?:[^"\\]|\\.)*")')
+
+    async def handle(self, scope, body: bytes, send) -> None:
+        if scope["method"] != "POST":
+            await _respond(send, 200, {})
+            return
+        if self._should_fail():
+            await _respond(send, 500, {"errors": [{"message": "Erro interno simulado"}]})
+            return
+        query = json.loads(body)["query"]
+        data = {}
+        for alias, origin in self.ALIAS_PATTERN.findall(query):
+            digest = hashlib.sha1(json.loads(origin).encode()).hexdigest()[:10]
+            data[alias] = {"shortLink": f"https://s.shopee.com.br/{digest}"}
+        await _respond(send, 200, {"data": data})
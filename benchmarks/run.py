@@ -0,0 +1,248 @@
+"""Teste de carga do bot, sem contactar o Telegram nem a Shopee.
+
+Arranca servidores falsos da Bot API e da API de afiliados (ver fake_servers.py), aponta o bot para
+eles e injeta atualizações sintéticas diretamente na aplicação ASGI (bot.app), medindo:
+
+- submissões de produtos por utilizadores (confirmação do webhook e resposta final ao utilizador)
+- lotes /add6 seguidos de /video (conversão e notificação dos subscritores)
+- um /enviar para todos os utilizadores registados (dois, com --blocked, para ver a exclusão
+  dos utilizadores inalcançáveis)
+
+Uso (na raiz do repositório):
+    python benchmarks/run.py --users 2000 --telegram-latency 0.05 --shopee-latency 0.2
+
+Tudo corre numa pasta temporária, com uma base de dados nova. Para medir a capacidade do bot e não
+o limite do Telegram, o ritmo dos envios em massa pode ser aumentado com --broadcast-rate.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCHMARK"
+ADMIN_ID = 1000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Teste de carga do bot com servidores falsos do Telegram e da Shopee.")
+    parser.add_argument("--users", type=int, default=500, help="utilizadores que submetem um produto cada")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="fração de submissões de produtos repetidos")
+    parser.add_argument("--concurrency", type=int, default=50, help="pedidos simultâneos ao webhook")
+    parser.add_argument("--batches", type=int, default=10, help="ciclos /add6 + /video")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument("--telegram-errors", type=float, default=0.0, help="fração de pedidos ao Telegram com erro")
+    parser.add_argument("--blocked", type=float, default=0.0, help="fração de utilizadores que bloquearam o bot")
+    parser.add_argument("--shopee-latency", type=float, default=0.1)
+    parser.add_argument("--shopee-errors", type=float, default=0.0, help="fração de pedidos à Shopee com erro")
+    parser.add_argument("--broadcast-rate", type=float, default=None, help="mensagens/segundo do /enviar (omissão: BROADCAST_RATE)")
+    parser.add_argument("--submission-rate", type=float, default=None,
+                        help="limite global de links/segundo (omissão: sem limite, para medir a capacidade)")
+    parser.add_argument("--workers", type=int, default=None, help="UPDATE_WORKERS do bot")
+    parser.add_argument("--state-backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--verbose", action="store_true", help="mostra o output do bot")
+    return parser.parse_args()
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(p * (len(ordered) - 1)))]
+
+def report(name: str, latencies: list, elapsed: float, count: int = None) -> None:
+    # sys.__stdout__: o output do bot pode estar redirecionado durante os cenários
+    count = len(latencies) if count is None else count
+    line = f"{name:<28} {count:>7} em {elapsed:7.2f}s  {count / elapsed if elapsed else 0:9.1f}/s"
+    if latencies:
+        line += f"  p50 {percentile(latencies, 0.5) * 1000:8.1f}ms  p99 {percentile(latencies, 0.99) * 1000:8.1f}ms"
+    print(line, file=sys.__stdout__)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def serve(app, port: int):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+class BotDriver:
+    """Chama a aplicação ASGI do bot diretamente, como faria o servidor web."""
+
+    def __init__(self, app):
+        self.app = app
+        self.update_id = 0
+        self._lifespan = None
+        self._lifespan_queue = asyncio.Queue()
+        self._lifespan_events = asyncio.Queue()
+
+    async def start(self) -> None:
+        async def send(message):
+            await self._lifespan_events.put(message["type"])
+        self._lifespan = asyncio.create_task(self.app({"type": "lifespan"}, self._lifespan_queue.get, send))
+        await self._lifespan_queue.put({"type": "lifespan.startup"})
+        event = await self._lifespan_events.get()
+        if event != "lifespan.startup.complete":
+            raise RuntimeError("O bot não arrancou")
+
+    async def stop(self) -> None:
+        await self._lifespan_queue.put({"type": "lifespan.shutdown"})
+        await self._lifespan
+
+    async def post_update(self, chat_id: int, text: str) -> int:
+        """Envia uma mensagem sintética para o webhook e devolve o código HTTP."""
+        self.update_id += 1
+        message = {
+            "message_id": self.update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"U{chat_id}"},
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        body = json.dumps({"update_id": self.update_id, "message": message}).encode()
+        responses = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            responses.append(message)
+        scope = {"type": "http", "path": "/webhook", "method": "POST", "headers": []}
+        await self.app(scope, receive, send)
+        return responses[0]["status"]
+
+async def submissions(bot, driver, telegram, args, shopee_url: str) -> None:
+    """Cada utilizador envia um link de produto; uma parte repete produtos já enviados."""
+    distinct = max(1, int(args.users * (1 - args.duplicates)))
+    jobs = [(10_000 + i, f"{shopee_url}/shopee/product/{i % distinct + 1}/{i % distinct + 1}") for i in range(args.users)]
+    ack_latencies, sent_at = [], {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def submit(chat_id, link):
+        async with semaphore:
+            started = time.perf_counter()
+            sent_at[chat_id] = started
+            await driver.post_update(chat_id, "/start")
+            await driver.post_update(chat_id, link)
+            ack_latencies.append((time.perf_counter() - started) / 2)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(submit(chat_id, link) for chat_id, link in jobs))
+    acked = time.perf_counter() - started
+    await bot.pipeline.join()
+    elapsed = time.perf_counter() - started
+    end_to_end = [telegram.last_reply[chat_id] - t for chat_id, t in sent_at.items() if chat_id in telegram.last_reply]
+    report("webhook (confirmação)", ack_latencies, acked, len(jobs) * 2)
+    report("submissão (resposta final)", end_to_end, elapsed)
+
+async def batches(bot, driver, args) -> None:
+    """Ciclos /add6 + /video do admin; cada comando é medido até o bot terminar de o processar."""
+    latencies = {"/add6": [], "/video": []}
+    started = time.perf_counter()
+    for i in range(args.batches):
+        for command in ("/add6", f"/video https://shopee.com.br/video/{i}"):
+            command_started = time.perf_counter()
+            await driver.post_update(ADMIN_ID, command)
+            await bot.pipeline.join()
+            latencies[command.split()[0]].append(time.perf_counter() - command_started)
+    elapsed = time.perf_counter() - started
+    for command, values in latencies.items():
+        report(command, values, elapsed)
+
+async def broadcast(bot, driver) -> None:
+    """Um /enviar para todos os utilizadores, medido até o envio ficar concluído."""
+    from database import list_broadcast_jobs
+    started = time.perf_counter()
+    await driver.post_update(ADMIN_ID, "/enviar Mensagem do teste de carga")
+    await bot.pipeline.join()
+    job = list_broadcast_jobs(limit=1)[0]
+    while job["status"] != "done":
+        await asyncio.sleep(0.1)
+        job = list_broadcast_jobs(limit=1)[0]
+    elapsed = time.perf_counter() - started
+    report("/enviar (mensagens)", [], elapsed, job['sent'] + job['failed'])
+    print(f"{'':<28} sucesso {job['sent']}, falha {job['failed']}, total {job['total']}", file=sys.__stdout__)
+
+async def main(args) -> None:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_servers import FakeTelegram, FakeShopee
+
+    # Os utilizadores que bloqueiam o bot só o fazem depois de submeterem o produto
+    blocked = random.sample(range(10_000, 10_000 + args.users), int(args.users * args.blocked))
+    telegram = FakeTelegram(args.telegram_latency, args.telegram_errors)
+    shopee = FakeShopee(args.shopee_latency, args.shopee_errors)
+    telegram_port, shopee_port = free_port(), free_port()
+    shopee_url = f"http://127.0.0.1:{shopee_port}"
+    servers = [await serve(telegram, telegram_port), await serve(shopee, shopee_port)]
+
+    # A configuração é lida ao importar o bot, por isso o ambiente é preparado antes
+    os.environ.update({
+        "TELEGRAM_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{telegram_port}/bot",
+        "SHOPEE_API_URL": f"{shopee_url}/graphql",
+        "SHOPEE_APP_ID": "bench",
+        "SHOPEE_SECRET": "bench",
+        "ADMIN_IDS": str(ADMIN_ID),
+        "STATE_BACKEND": args.state_backend,
+    })
+    if args.broadcast_rate:
+        os.environ["BROADCAST_RATE"] = str(args.broadcast_rate)
+    # Sem --submission-rate o limite global fica tão alto que nunca é atingido
+    submission_rate = args.submission_rate or 1e9
+    os.environ["SUBMISSION_GLOBAL_RATE"] = str(submission_rate)
+    os.environ["SUBMISSION_GLOBAL_BURST"] = str(max(submission_rate, 1))
+    if args.workers:
+        os.environ["UPDATE_WORKERS"] = str(args.workers)
+    sys.path.insert(0, ROOT)
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        import logging
+        import bot
+        if not args.verbose:
+            # Os erros injetados geram tracebacks esperados; são contados no resumo final
+            logging.disable(logging.ERROR)
+        driver = BotDriver(bot.app)
+        await driver.start()
+
+    print(f"Telegram falso: latência {args.telegram_latency}s, erros {args.telegram_errors:.0%} | "
+          f"Shopee falsa: latência {args.shopee_latency}s, erros {args.shopee_errors:.0%}")
+    try:
+        with output:
+            await submissions(bot, driver, telegram, args, shopee_url)
+        with output:
+            await batches(bot, driver, args)
+        telegram.blocked.update(blocked)
+        with output:
+            await broadcast(bot, driver)
+        if blocked:
+            with output:
+                await broadcast(bot, driver)
+    finally:
+        with output:
+            await driver.stop()
+        for server, task in servers:
+            server.should_exit = True
+            await task
+    from metrics import handler_errors, submissions_rejected
+    print(f"Pedidos: Telegram {telegram.requests} ({telegram.errors} erros injetados), "
+          f"Shopee {shopee.requests} ({shopee.errors} erros injetados), "
+          f"exceções nos handlers: {handler_errors.total():.0f}, "
+          f"submissões recusadas: {submissions_rejected.total():.0f}")
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        # A base de dados e as caches são criadas na pasta temporária
+        os.chdir(workdir)
+        asyncio.run(main(arguments))
@@ -1,16 +1,36 @@
-from flask import Flask, request, jsonify
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 import asyncio
+import json
 import logging
+import time
 
 # Importa as configurações e os comandos dos outros ficheiros
-from config import TOKEN, ADMIN_IDS
-from database import load_video_db, load_user_ids, save_video_db, save_user_ids
-from comandos_user import start, tutorial, ajuda, cupom, handle_user_message
+from config import (
+    TOKEN, TELEGRAM_API_URL, ADMIN_IDS, BROADCAST_CONCURRENCY, WEBHOOK_SECRET, UPDATE_WORKERS,
+    SHUTDOWN_TIMEOUT, DEDUP_WINDOW, DEDUP_MAX_SIZE, STATE_BACKEND
+)
+from catalogo import VideoCatalog
+from utilizadores import UserRegistry
+from gravacao import write_behind
+from entregas import delivery_ledger
+from estado import SharedVideoCatalog, SharedUserRegistry, SharedLinkQueue
+from persistencia import SQLitePersistence
+from api_shopee import conversion_cache, resolve_cache, close_client
+from broadcast import watch_broadcast_jobs, interrupt_running_jobs, running_job_count
+from metrics import (
+    InstrumentedRequest, timed_handler, register_gauge, render_metrics, update_latency, webhook_requests
+)
+from pipeline import UpdatePipeline
+from dedup import UpdateDeduplicator
+from link_queue import LinkQueue
+from preconversao import PreConverter
+from comandos_user import start, tutorial, ajuda, cupom, handle_user_message, submission_limiter
 from comandos_admin import (
     add_links, pendentes, addmanual, add, video, cancelar, enviar, 
-    deletar_video, esgotado, bugado, handle_admin_message
+    deletar_video, produtos_video, esgotado, bugado, cache_stats, envios, pausar, retomar, audiencia,
+    tickets, fechar,
+    handle_admin_message
 )
 
 # Configuração de logging para vermos os erros no output da Replit
@@ -23,13 +43,36 @@ logger = logging.getLogger(__name__)
 # --- CONFIGURAÇÃO DO BOT (MODO WEBHOOK) ---
 
 async def setup_bot():
-    """Configura e inicializa a aplicação do bot do Telegram."""
-    application = Application.builder().token(TOKEN).build()
+    """Configura a aplicação do bot do Telegram e carrega as bases de dados."""
+    # O pool de ligações ao Telegram tem de acompanhar os envios em paralelo do /enviar
+    # O InstrumentedRequest mede a latência e os erros de cada chamada à API do Telegram
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .request(InstrumentedRequest(connection_pool_size=BROADCAST_CONCURRENCY + 8, pool_timeout=30))
+    )
+    if STATE_BACKEND == "sqlite":
+        # Vários processos: o user_data (estado dos comandos de admin) também fica na base de dados
+        builder = builder.persistence(SQLitePersistence())
+    application = builder.build()
 
-    # Carrega as bases de dados para a memória ao iniciar
-    application.bot_data['video_db'] = load_video_db()
-    application.bot_data['user_ids'] = load_user_ids()
+    if STATE_BACKEND == "sqlite":
+        # Tudo é lido e escrito diretamente na base de dados partilhada pelos workers
+        application.bot_data['video_db'] = SharedVideoCatalog()
+        application.bot_data['user_ids'] = SharedUserRegistry()
+        application.bot_data['link_queue'] = SharedLinkQueue()
+    else:
+        # Carrega as bases de dados para a memória ao iniciar (um único processo)
+        application.bot_data['video_db'] = VideoCatalog.load()
+        application.bot_data['user_ids'] = UserRegistry.load()
+        application.bot_data['link_queue'] = LinkQueue.load()
+    application.bot_data['preconverter'] = PreConverter(application.bot_data['link_queue'])
+    conversion_cache.load()
+    delivery_ledger.load()
     print(f"Bot a iniciar... {len(application.bot_data['user_ids'])} utilizadores carregados.")
+    print(f"Fila de pendentes: {len(application.bot_data['link_queue'])} links.")
+    print(f"Cache de conversões: {len(conversion_cache)} links carregados.")
 
     # --- Registo de Comandos ---
     admin_filter = filters.User(user_id=ADMIN_IDS)
@@ -43,6 +86,9 @@ async def setup_bot():
     
     # Comandos de Admin
     application.add_handler(CommandHandler("enviar", enviar, admin_filter))
+    application.add_handler(CommandHandler("envios", envios, admin_filter))
+    application.add_handler(CommandHandler("pausar", pausar, admin_filter))
+    application.add_handler(CommandHandler("retomar", retomar, admin_filter))
     for i in range(1, 7):
         application.add_handler(CommandHandler(f"add{i}", add_links, admin_filter))
     application.add_handler(CommandHandler("pendentes", pendentes, admin_filter))
@@ -53,42 +99,185 @@ async def setup_bot():
     application.add_handler(CommandHandler("esgotado", esgotado, admin_filter))
     application.add_handler(CommandHandler("bugado", bugado, admin_filter))
     application.add_handler(CommandHandler("deletarvideo", deletar_video, admin_filter))
+    application.add_handler(CommandHandler("produtos", produtos_video, admin_filter))
+    application.add_handler(CommandHandler("cache", cache_stats, admin_filter))
+    application.add_handler(CommandHandler("audiencia", audiencia, admin_filter))
+    application.add_handler(CommandHandler("tickets", tickets, admin_filter))
+    application.add_handler(CommandHandler("fechar", fechar, admin_filter))
 
     # --- Processadores de Mensagens ---
     application.add_handler(MessageHandler(filters.PHOTO & admin_filter, enviar))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & admin_filter, handle_admin_message))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND & user_filter, handle_user_message))
-    
+
+    # Mede a duração de todos os handlers registados acima (bot_handler_seconds em /metrics)
+    for group in application.handlers.values():
+        for handler in group:
+            handler.callback = timed_handler(handler.callback)
+    _register_state_gauges(application)
+
     return application
 
-# --- CONFIGURAÇÃO DO SERVIDOR WEB (FLASK) ---
+def _register_state_gauges(application) -> None:
+    """Métricas lidas no momento do /metrics: filas, caches e envios em curso."""
+    bot_data = application.bot_data
+    register_gauge("bot_link_queue_depth", "Links à espera na fila de produtos.", lambda: {(): len(bot_data['link_queue'])})
+    register_gauge("bot_update_queue_depth", "Atualizações à espera nos workers.", lambda: {(): len(pipeline) if pipeline else 0})
+    caches = {"conversion": conversion_cache, "resolve": resolve_cache}
+    register_gauge("bot_cache_hit_ratio", "Proporção de acertos de cada cache.",
+                   lambda: {(name,): cache.stats()['hit_ratio'] for name, cache in caches.items()}, ("cache",))
+    register_gauge("bot_cache_entries", "Entradas em cada cache.",
+                   lambda: {(name,): len(cache) for name, cache in caches.items()}, ("cache",))
+    register_gauge("bot_broadcast_jobs_running", "Envios em massa a decorrer neste processo.", lambda: {(): running_job_count()})
+    register_gauge("bot_rate_limit_buckets", "Utilizadores com limite de mensagens ativo neste processo.",
+                   lambda: {(): len(submission_limiter)})
+
+# --- CICLO DE VIDA ---
+
+bot_app = None
+pipeline = None
+jobs_watcher = None
+deduplicator = UpdateDeduplicator(DEDUP_WINDOW, DEDUP_MAX_SIZE)
+
+async def process_update(update: Update) -> None:
+    started = time.perf_counter()
+    await bot_app.process_update(update)
+    update_latency.observe(time.perf_counter() - started)
+    if bot_app.persistence:
+        # Grava já o user_data alterado, para o próximo comando poder ser atendido por outro worker
+        await bot_app.update_persistence()
+
+def chat_key(update: Update):
+    """Chave usada para manter a ordem das atualizações: o chat (ou o utilizador, ou a própria atualização)."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return update.update_id
+
+async def startup():
+    """Inicializa o bot, arranca os workers e retoma o trabalho interrompido pelo último reinício."""
+    global bot_app, pipeline, jobs_watcher
+    bot_app = await setup_bot()
+    await bot_app.initialize()
+    await bot_app.start()
+    deduplicator.load()
+    pipeline = UpdatePipeline(process_update, UPDATE_WORKERS)
+    pipeline.start()
+
+    # Retoma os envios interrompidos, também os de outro worker que tenha morrido. É uma tarefa
+    # asyncio à parte porque o Application.stop() esperaria por ela e nunca terminaria.
+    # Pelo mesmo motivo, a pré-conversão da fila também corre fora do Application (ver PreConverter)
+    jobs_watcher = asyncio.create_task(watch_broadcast_jobs(bot_app))
+    bot_app.bot_data['preconverter'].wake()
+
+async def shutdown():
+    """Termina as atualizações pendentes e fecha as ligações de forma ordenada."""
+    # Os envios em massa param já; como estão guardados na base de dados, retomam no próximo arranque
+    jobs_watcher.cancel()
+    interrupt_running_jobs()
+    bot_app.bot_data['preconverter'].stop()
+    await pipeline.stop(SHUTDOWN_TIMEOUT)
+    # Grava já o que estiver pendente, antes de esperar pelo fecho do Application
+    write_behind.flush()
+    await bot_app.stop()
+    await bot_app.shutdown()
+    write_behind.stop()
+    if STATE_BACKEND == "memory":
+        # Snapshot binário dos utilizadores, para o próximo arranque ler tudo de uma vez
+        bot_app.bot_data['user_ids'].save()
+    await close_client()
+    conversion_cache.save()
+
+# --- SERVIDOR WEB (ASGI) ---
+# O webhook apenas valida e põe a atualização na fila; responde ao Telegram de imediato e o
+# processamento acontece nos workers do pipeline. Correr com um servidor ASGI, por exemplo:
+#   gunicorn bot:app -k uvicorn.workers.UvicornWorker
+# Com vários workers (-w N) é obrigatório STATE_BACKEND=sqlite. A ordem das atualizações de um
+# mesmo chat só é garantida dentro de cada worker.
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
 
-app = Flask(__name__)
-bot_app = asyncio.run(setup_bot())
+async def _respond(send, status: int, payload, content_type: bytes = b"application/json") -> None:
+    body = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
 
-@app.route('/webhook', methods=['POST'])
-async def webhook():
-    """Processa as atualizações recebidas do Telegram."""
+async def webhook(scope, receive, send):
+    """Valida a atualização recebida do Telegram e põe-na na fila de processamento."""
+    if WEBHOOK_SECRET:
+        headers = dict(scope.get("headers") or [])
+        if headers.get(b"x-telegram-bot-api-secret-token", b"").decode() != WEBHOOK_SECRET:
+            webhook_requests.inc("forbidden")
+            await _respond(send, 403, {"status": "forbidden"})
+            return
+    if pipeline is None or not pipeline.running:
+        webhook_requests.inc("unavailable")
+        await _respond(send, 503, {"status": "starting"})
+        return
     try:
-        update = Update.de_json(request.get_json(force=True), bot_app.bot)
-        await bot_app.process_update(update)
-        return jsonify(status='ok'), 200
+        data = json.loads(await _read_body(receive))
+        if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+            raise ValueError("update_id em falta")
+        update = Update.de_json(data, bot_app.bot)
     except Exception as e:
-        logger.error(f"Erro no webhook: {e}")
-        return jsonify(status='error', error=str(e)), 500
+        logger.error(f"Atualização inválida recebida no webhook: {e}")
+        webhook_requests.inc("invalid")
+        await _respond(send, 400, {"status": "error", "error": str(e)})
+        return
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Endpoint para o UptimeRobot manter o bot 'acordado'."""
-    return jsonify(status='ok'), 200
+    # Entrega repetida pelo Telegram: confirma sem voltar a processar
+    if not deduplicator.claim(update.update_id):
+        webhook_requests.inc("duplicate")
+        await _respond(send, 200, {"status": "duplicate"})
+        return
+    pipeline.submit(chat_key(update), update)
+    webhook_requests.inc("ok")
+    await _respond(send, 200, {"status": "ok"})
 
-@app.route('/')
-def index():
-    """Página inicial que confirma que o bot está a funcionar."""
-    return "Olá! O servidor do bot está a funcionar. Configure o webhook para /webhook.", 200
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                logger.exception("Falha ao iniciar o bot")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
 
-# Esta parte não é necessária para a Replit, mas é uma boa prática
-if __name__ == '__main__':
-    # O Gunicorn irá iniciar a aplicação, não precisamos de app.run()
-    pass
+async def app(scope, receive, send):
+    """Aplicação ASGI: /webhook (Telegram), /health (UptimeRobot), /metrics (Prometheus) e / (página inicial)."""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
 
+    path, method = scope["path"], scope["method"]
+    if path == "/webhook" and method == "POST":
+        await webhook(scope, receive, send)
+    elif path == "/health" and method in ("GET", "HEAD"):
+        # Endpoint para o UptimeRobot manter o bot 'acordado'
+        await _respond(send, 200, {"status": "ok"})
+    elif path == "/metrics" and method == "GET":
+        await _respond(send, 200, render_metrics(), b"text/plain; version=0.0.4; charset=utf-8")
+    elif path == "/" and method in ("GET", "HEAD"):
+        await _respond(send, 200, "Olá! O servidor do bot está a funcionar. Configure o webhook para /webhook.", b"text/plain; charset=utf-8")
+    else:
+        await _respond(send, 404, {"status": "not found"})
@@ -0,0 +1,311 @@
+import asyncio
+import os
+import socket
+import time
+from telegram.error import RetryAfter, TimedOut, NetworkError, Forbidden, BadRequest
+from config import (
+    BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL, BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_RETRIES, BROADCAST_PROGRESS_INTERVAL, BROADCAST_LEASE, BROADCAST_PREPARE_CHUNK
+)
+from ratelimit import TelegramRateLimiter
+from metrics import broadcast_messages
+from entregas import delivery_ledger
+from database import (
+    get_broadcast_job, list_broadcast_jobs, pending_broadcast_recipients, record_broadcast_result,
+    set_broadcast_job_status, claim_broadcast_job, release_broadcast_job,
+    create_broadcast_job, add_broadcast_recipients, last_broadcast_recipient, start_broadcast_job,
+    set_broadcast_status_message
+)
+
+# Limitador partilhado por todos os envios em massa (o limite do Telegram é por bot, não por envio)
+telegram_limiter = TelegramRateLimiter(BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Devolve o tempo de espera pedido pelo Telegram em segundos (int ou timedelta, conforme a versão)."""
+    value = error.retry_after
+    return value.total_seconds() if hasattr(value, 'total_seconds') else float(value)
+
+class BroadcastResult:
+    """Contadores de um envio em massa."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.sucesso = 0
+        self.falha = 0
+        self.inalcancaveis = 0 # utilizadores que passaram a estar inalcançáveis neste envio
+        self.started_at = time.monotonic()
+
+    @property
+    def done(self) -> int:
+        return self.sucesso + self.falha
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+async def send_with_retry(chat_id: int, send) -> None:
+    """Envia uma mensagem respeitando o limitador; em RetryAfter pausa todos os envios e tenta de novo.
+
+    Erros definitivos (Forbidden, BadRequest) e falhas de rede após BROADCAST_MAX_RETRIES são propagados.
+    """
+    attempt = 0
+    while True:
+        await telegram_limiter.acquire(chat_id)
+        try:
+            await send(chat_id)
+            return
+        except RetryAfter as e:
+            # Flood wait: não é uma falha do utilizador, por isso não conta como tentativa
+            wait = retry_after_seconds(e)
+            print(f"Flood wait do Telegram: a pausar os envios durante {wait:.0f}s...")
+            telegram_limiter.pause(wait)
+        except (Forbidden, BadRequest):
+            raise
+        except (TimedOut, NetworkError):
+            attempt += 1
+            if attempt > BROADCAST_MAX_RETRIES:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+async def broadcast(user_ids, send, progress=None, on_result=None, stop_event: asyncio.Event = None) -> BroadcastResult:
+    """Envia para todos os `user_ids` em paralelo, limitado pelo ritmo permitido pelo Telegram.
+
+    `send(chat_id)` é a coroutine que faz o envio para um utilizador. `progress(result)`, se
+    indicado, é chamado a cada BROADCAST_PROGRESS_INTERVAL segundos e no fim.
+    `on_result(chat_id, error)` é chamado após cada destinatário (error é None ou a exceção), e `stop_event`, quando
+    ativado, faz os workers pararem antes do próximo envio.
+    """
+    user_ids = list(user_ids)
+    result = BroadcastResult(len(user_ids))
+    pending = iter(user_ids)
+
+    async def worker():
+        # Todos os workers partilham o mesmo iterador, por isso cada ID é enviado uma única vez
+        for uid in pending:
+            if stop_event is not None and stop_event.is_set():
+                return
+            error = None
+            try:
+                await send_with_retry(uid, send)
+                result.sucesso += 1
+                broadcast_messages.inc("ok")
+            except Exception as e:
+                error = e
+                result.falha += 1
+                broadcast_messages.inc("fail")
+                print(f"Falha ao enviar para o ID {uid}: {e}")
+            if on_result:
+                on_result(uid, error)
+
+    async def reporter():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            await _report(progress, result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BROADCAST_CONCURRENCY, len(user_ids)) or 1)]
+    reporter_task = asyncio.create_task(reporter()) if progress else None
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        if reporter_task:
+            reporter_task.cancel()
+    await _report(progress, result)
+    return result
+
+async def _report(progress, result: BroadcastResult) -> None:
+    if not progress:
+        return
+    try:
+        await progress(result)
+    except Exception as e:
+        # O progresso é apenas informativo; uma falha aqui não pode interromper o envio
+        print(f"Falha ao atualizar o progresso do envio: {e}")
+
+# --- ENVIOS PERSISTENTES ---
+# Cada /enviar é guardado na base de dados com o estado de cada destinatário, por isso um envio
+# interrompido (reinício, pausa) continua apenas para quem ainda não recebeu a mensagem.
+
+# Envios a decorrer neste processo: job_id -> evento que pede a pausa
+_running_jobs = {}
+
+# Identifica este processo na reserva dos envios (vários workers podem partilhar a base de dados)
+JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+def running_job_count() -> int:
+    return len(_running_jobs)
+
+async def prepare_broadcast_job(created_by: int, text: str, photo_id) -> int:
+    """Cria um envio com todos os utilizadores registados (exceto os inalcançáveis) e devolve o seu ID.
+
+    Os destinatários são registados em blocos de BROADCAST_PREPARE_CHUNK, por ordem de ID, com
+    uma transação curta por bloco e o event loop livre entre blocos; com milhões de utilizadores
+    o bot continua a responder enquanto o envio é preparado. Só no fim o envio passa a 'running'.
+    Se o processo morrer a meio, o envio fica 'preparing' com a reserva por renovar e é
+    retomado por watch_broadcast_jobs (ver resume_broadcast_preparation).
+    """
+    job_id = create_broadcast_job(created_by, text, photo_id, JOB_OWNER, BROADCAST_LEASE)
+    await _add_all_recipients(job_id)
+    return job_id
+
+async def _add_all_recipients(job_id: int) -> None:
+    """Regista os destinatários em falta, a partir do último já registado, e passa o envio a 'running'."""
+    last_user_id = last_broadcast_recipient(job_id)
+    while (last_user_id := add_broadcast_recipients(job_id, last_user_id, BROADCAST_PREPARE_CHUNK)) is not None:
+        claim_broadcast_job(job_id, JOB_OWNER, BROADCAST_LEASE)
+        await asyncio.sleep(0)
+    start_broadcast_job(job_id)
+
+async def resume_broadcast_preparation(bot, job_id: int) -> None:
+    """Conclui a preparação de um envio interrompido e executa-o; quem chama já tem a reserva do envio."""
+    await _add_all_recipients(job_id)
+    job = get_broadcast_job(job_id)
+    if not job['status_chat_id']:
+        # O admin não chegou a receber a mensagem de início do envio
+        try:
+            status_message = await bot.send_message(
+                chat_id=job['created_by'],
+                text=f"O envio #{job_id} foi interrompido enquanto era preparado e foi retomado: a enviar para {job['total']} utilizadores..."
+            )
+            set_broadcast_status_message(job_id, status_message.chat_id, status_message.message_id)
+        except Exception as e:
+            print(f"Falha ao informar a retoma do envio #{job_id}: {e}")
+    await run_and_report_broadcast_job(bot, job_id)
+
+def claim_interrupted_preparation(job: dict) -> bool:
+    """Reserva para este processo um envio cuja preparação foi interrompida (reserva expirada).
+
+    Devolve False se o envio não estiver 'preparing' ou se ainda estiver a ser preparado.
+    """
+    return (
+        job['status'] == 'preparing' and job['lease_until'] <= time.time()
+        and claim_broadcast_job(job['id'], JOB_OWNER, BROADCAST_LEASE)
+    )
+
+def is_job_running(job_id: int) -> bool:
+    """True se o envio estiver a decorrer neste processo ou reservado por outro processo ainda ativo."""
+    if job_id in _running_jobs:
+        return True
+    job = get_broadcast_job(job_id)
+    return job is not None and job['status'] == 'running' and job['lease_until'] > time.time()
+
+def job_progress_text(job: dict, result: BroadcastResult = None) -> str:
+    """Texto de progresso de um envio, somando o que já estava registado com o progresso atual."""
+    sucesso = job['sent'] + (result.sucesso if result else 0)
+    falha = job['failed'] + (result.falha if result else 0)
+    return (
+        f"Envio #{job['id']}: {sucesso + falha}/{job['total']}\n\n"
+        f"✅ Sucesso: {sucesso}\n❌ Falha: {falha}"
+    )
+
+async def run_broadcast_job(bot, job_id: int):
+    """Envia (ou retoma) um envio persistente para os destinatários ainda pendentes.
+
+    Devolve o BroadcastResult desta execução, ou None se o envio não existir, já estiver
+    concluído ou já estiver a decorrer (neste ou noutro processo).
+    """
+    job = get_broadcast_job(job_id)
+    if job is None or job['status'] in ('preparing', 'done') or job_id in _running_jobs:
+        return None
+    if not claim_broadcast_job(job_id, JOB_OWNER, BROADCAST_LEASE):
+        return None
+
+    stop_event = asyncio.Event()
+    _running_jobs[job_id] = stop_event
+    set_broadcast_job_status(job_id, 'running')
+    lease_task = asyncio.create_task(_keep_lease(job_id, stop_event))
+    try:
+        pending = pending_broadcast_recipients(job_id)
+
+        async def send(uid):
+            if job['photo_id']:
+                await bot.send_photo(chat_id=uid, photo=job['photo_id'], caption=job['text'])
+            else:
+                await bot.send_message(chat_id=uid, text=job['text'])
+
+        async def progress(result):
+            if job['status_chat_id']:
+                await bot.edit_message_text(
+                    chat_id=job['status_chat_id'], message_id=job['status_message_id'],
+                    text=job_progress_text(job, result)
+                )
+
+        newly_unreachable = 0
+
+        def on_result(uid, error):
+            nonlocal newly_unreachable
+            record_broadcast_result(job_id, uid, error is None, str(error) if error else None)
+            if delivery_ledger.record(uid, error):
+                newly_unreachable += 1
+
+        result = await broadcast(pending, send, progress, on_result, stop_event)
+        result.inalcancaveis = newly_unreachable
+    finally:
+        lease_task.cancel()
+        _running_jobs.pop(job_id, None)
+        release_broadcast_job(job_id, JOB_OWNER)
+
+    # Só fica concluído se não restar nenhum destinatário pendente. Se foi interrompido (ao desligar
+    # o bot) e não pausado por um admin, continua 'running' para ser retomado no próximo arranque.
+    if not pending_broadcast_recipients(job_id):
+        set_broadcast_job_status(job_id, 'done')
+    return result
+
+async def _keep_lease(job_id: int, stop_event: asyncio.Event) -> None:
+    """Renova a reserva do envio e para-o se outro processo o tiver pausado (ou ficado com a reserva)."""
+    while not stop_event.is_set():
+        await asyncio.sleep(min(BROADCAST_PROGRESS_INTERVAL, BROADCAST_LEASE / 3))
+        job = get_broadcast_job(job_id)
+        if job is None or job['status'] == 'paused' or not claim_broadcast_job(job_id, JOB_OWNER, BROADCAST_LEASE):
+            stop_event.set()
+
+async def watch_broadcast_jobs(application) -> None:
+    """Retoma os envios 'running' ou 'preparing' sem reserva válida: interrompidos por um reinício
+    ou por um worker que morreu.
+
+    A reserva na base de dados garante que cada envio é retomado por um único processo.
+    """
+    while True:
+        for job in list_broadcast_jobs(limit=100, status='preparing'):
+            if claim_interrupted_preparation(job):
+                print(f"A retomar a preparação do envio #{job['id']} interrompido...")
+                application.create_task(resume_broadcast_preparation(application.bot, job['id']))
+        for job in list_broadcast_jobs(limit=100, status='running'):
+            if job['id'] not in _running_jobs and job['lease_until'] <= time.time():
+                print(f"A retomar o envio #{job['id']} interrompido ({job['sent'] + job['failed']}/{job['total']})...")
+                application.create_task(run_and_report_broadcast_job(application.bot, job['id']))
+        await asyncio.sleep(BROADCAST_LEASE)
+
+def interrupt_running_jobs() -> None:
+    """Para os envios em curso neste processo sem os marcar como pausados (usado ao desligar)."""
+    for stop_event in _running_jobs.values():
+        stop_event.set()
+
+def pause_broadcast_job(job_id: int) -> bool:
+    """Pede a pausa de um envio; devolve False se o envio não existir, ainda estiver a ser preparado ou já estiver concluído."""
+    job = get_broadcast_job(job_id)
+    if job is None or job['status'] in ('preparing', 'done'):
+        return False
+    set_broadcast_job_status(job_id, 'paused')
+    stop_event = _running_jobs.get(job_id)
+    if stop_event is not None:
+        stop_event.set()
+    return True
+
+async def run_and_report_broadcast_job(bot, job_id: int) -> None:
+    """Executa um envio persistente e, no fim, informa o admin no chat da mensagem de progresso."""
+    result = await run_broadcast_job(bot, job_id)
+    job = get_broadcast_job(job_id)
+    if result is None or not job['status_chat_id'] or job['status'] == 'running':
+        return
+    if job['status'] == 'done':
+        text = f"Envio #{job_id} concluído em {result.elapsed:.0f}s!\n\n✅ Sucesso: {job['sent']}\n❌ Falha: {job['failed']}"
+        if result.inalcancaveis:
+            text += f"\n🚫 {result.inalcancaveis} utilizador(es) inalcançável(is) excluído(s) dos próximos envios (ver /audiencia)"
+    else:
+        text = f"Envio #{job_id} pausado.\n\n{job_progress_text(job)}\n\nUse /retomar {job_id} para continuar."
+    try:
+        await bot.send_message(chat_id=job['status_chat_id'], text=text)
+    except Exception as e:
+        print(f"Falha ao informar o resultado do envio #{job_id}: {e}")
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from metrics import storage_latency
+
+# Parâmetros de rastreamento que não mudam a página de destino (além dos utm_*)
+TRACKING_PARAMS = {'sp_atk', 'xptdk', 'smtt', 'gclid', 'fbclid', 'mmp_pid'}
+
+def normalize_url(url: str) -> str:
+    """Normaliza um URL para servir de chave: esquema/domínio em minúsculas, sem fragmento, barra final
+    ou parâmetros de rastreamento. Os restantes parâmetros ficam (podem identificar o produto, ex.: ?shopid=&itemid=).
+    """
+    parts = urlsplit(url.strip())
+    path = parts.path.rstrip('/') or '/'
+    query = urlencode([
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in TRACKING_PARAMS and not name.lower().startswith('utm_')
+    ])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
+
+class TTLCache:
+    """Cache em memória com limite de tamanho (despejo LRU) e tempo de vida por entrada."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # chave -> (instante de expiração, valor); a ordem do OrderedDict é a ordem de uso
+        self._data = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Devolve o valor em cache (marcando-o como usado recentemente) ou `default` se não existir ou tiver expirado."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None) -> None:
+        """Guarda um valor; se a cache estiver cheia, remove a entrada usada há mais tempo."""
+        self._data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def stats(self) -> dict:
+        """Devolve os contadores de acertos/falhas e o tamanho atual."""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': (self.hits / total) if total else 0.0,
+            'size': len(self._data),
+            'max_size': self.max_size,
+        }
+
+class PersistentTTLCache(TTLCache):
+    """TTLCache que pode ser guardada num ficheiro JSON e recarregada ao reiniciar o bot.
+
+    O ficheiro é reescrito por inteiro, por isso não é gravado a cada alteração: com `save_interval`,
+    a primeira alteração agenda uma gravação para daí a `save_interval` segundos, que leva todas as
+    alterações feitas entretanto. Ao desligar o bot, `save()` grava o que faltar.
+
+    Com `shared=True` (vários processos a gravar o mesmo ficheiro), cada gravação junta primeiro as
+    entradas que os outros processos já lá deixaram e usa um ficheiro temporário próprio do processo,
+    para as gravações simultâneas não se sobreporem.
+    """
+
+    def __init__(self, path: str, max_size: int, ttl: float, save_interval: float = None, shared: bool = False):
+        super().__init__(max_size, ttl)
+        self.path = path
+        self.save_interval = save_interval
+        self.shared = shared
+        self.dirty = False
+        self._timer = None
+
+    def set(self, key, value, ttl: float = None) -> None:
+        super().set(key, value, ttl)
+        self.dirty = True
+        if self.save_interval is not None and self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.save_interval, self._on_timer)
+            except RuntimeError:
+                pass # Fora de um event loop (ex.: scripts): fica para o save() explícito
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        try:
+            with storage_latency.time(os.path.splitext(os.path.basename(self.path))[0]):
+                self.save()
+        except OSError as e:
+            print(f"Erro ao gravar a cache {self.path}: {e}")
+
+    def _read_file(self) -> OrderedDict:
+        """Entradas ainda válidas do ficheiro, do menos para o mais recentemente usado."""
+        entries = OrderedDict()
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            try:
+                stored = json.load(f)
+            except json.JSONDecodeError:
+                return entries # Ficheiro corrompido: começamos com a cache vazia
+        now = time.time()
+        for key, (expires_at, value) in stored:
+            if expires_at > now:
+                entries[key] = (expires_at, value)
+        return entries
+
+    def load(self) -> None:
+        """Carrega as entradas ainda válidas do ficheiro (as expiradas são descartadas)."""
+        self._data.update(self._read_file())
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        self.dirty = False
+
+    def save(self) -> None:
+        """Escreve a cache no disco de forma atómica (ficheiro temporário + rename), só se houver alterações."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.dirty:
+            return
+        if self.shared:
+            # As entradas dos outros processos ficam como as menos recentes; as deste processo prevalecem
+            merged = self._read_file()
+            merged.update(self._data)
+            while len(merged) > self.max_size:
+                merged.popitem(last=False)
+            self._data = merged
+        now = time.time()
+        entries = [[key, [expires_at, value]] for key, (expires_at, value) in self._data.items() if expires_at > now]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp" if self.shared else f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
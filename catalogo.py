@@ -0,0 +1,104 @@
+import sys
+from database import load_video_catalog, assign_video, delete_video_url
+from gravacao import write_behind
+
+class VideoCatalog:
+    """Catálogo de vídeos normalizado: cada URL de vídeo é guardado uma única vez.
+
+    - _videos: ID do vídeo -> URL (string partilhada com sys.intern)
+    - _video_ids: URL -> ID do vídeo
+    - _product_video: chave do produto -> ID do vídeo
+    - _products_by_video: ID do vídeo -> conjunto de produtos (índice inverso)
+
+    Consultar por produto é O(1); apagar um vídeo ou listar os seus produtos é O(k), sendo k o
+    número de produtos desse vídeo. O formato no disco (video_urls + product_videos) é o mesmo.
+    As alterações são gravadas em grupo pelo write_behind; os IDs em memória são atribuídos aqui e
+    podem não coincidir com os da base de dados (no disco os vídeos são identificados pelo URL).
+    """
+
+    def __init__(self, videos=(), links=()):
+        self._videos = {}
+        self._video_ids = {}
+        self._product_video = {}
+        self._products_by_video = {}
+        for video_id, url in videos:
+            self._add_video(video_id, url)
+        for product, video_id in links:
+            self._product_video[product] = video_id
+            self._products_by_video[video_id].add(product)
+        self._next_id = max(self._videos, default=0) + 1
+
+    @classmethod
+    def load(cls) -> 'VideoCatalog':
+        """Carrega o catálogo guardado na base de dados."""
+        return cls(*load_video_catalog())
+
+    def _add_video(self, video_id: int, url: str) -> None:
+        url = sys.intern(url)
+        self._videos[video_id] = url
+        self._video_ids[url] = video_id
+        self._products_by_video.setdefault(video_id, set())
+
+    def __len__(self) -> int:
+        return len(self._product_video)
+
+    def __contains__(self, product: str) -> bool:
+        return product in self._product_video
+
+    def __getitem__(self, product: str) -> str:
+        return self._videos[self._product_video[product]]
+
+    def get(self, product: str, default=None):
+        video_id = self._product_video.get(product)
+        return self._videos[video_id] if video_id is not None else default
+
+    @property
+    def video_count(self) -> int:
+        return len(self._videos)
+
+    def products_for(self, video_url: str) -> set:
+        """Produtos associados a um vídeo (conjunto vazio se o vídeo não existir)."""
+        video_id = self._video_ids.get(video_url)
+        return set(self._products_by_video.get(video_id, ())) if video_id is not None else set()
+
+    def assign(self, products, video_url: str) -> None:
+        """Associa um vídeo a vários produtos e agenda a gravação da alteração.
+
+        Um produto que já tinha outro vídeo passa para o novo; vídeos que ficam sem produtos são removidos.
+        """
+        products = list(dict.fromkeys(products)) # sem repetidos, pela ordem original
+        orphaned = set()
+        for product in products:
+            old_id = self._product_video.get(product)
+            if old_id is not None and self._videos[old_id] != video_url:
+                self._products_by_video[old_id].discard(product)
+                if not self._products_by_video[old_id]:
+                    orphaned.add(old_id)
+
+        for old_id in orphaned:
+            del self._video_ids[self._videos.pop(old_id)]
+            del self._products_by_video[old_id]
+        video_id = self._video_ids.get(video_url)
+        if video_id is None:
+            video_id = self._next_id
+            self._next_id += 1
+            self._add_video(video_id, video_url)
+        for product in products:
+            self._product_video[product] = video_id
+            self._products_by_video[video_id].add(product)
+
+        # Só depois de a memória estar atualizada; na base de dados, os vídeos que ficam sem
+        # produtos são removidos na mesma transação
+        write_behind.submit(assign_video, products, video_url)
+
+    def delete_video(self, video_url: str) -> list:
+        """Remove um vídeo e desvincula os seus produtos; devolve os produtos desvinculados."""
+        video_id = self._video_ids.get(video_url)
+        if video_id is None:
+            return []
+        write_behind.submit(delete_video_url, video_url)
+        products = self._products_by_video.pop(video_id)
+        del self._video_ids[self._videos.pop(video_id)]
+        for product in products:
+            del self._product_video[product]
+        return list(products)
@@ -2,57 +2,101 @@ from telegram import Update
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from telegram.helpers import escape_markdown
+from config import ADMIN_IDS, SHOPEE_BATCH_SIZE, ADD_CONVERT_CONCURRENCY, ADD_PROGRESS_INTERVAL
+from api_shopee import convert_shopee_links, resolve_short_link, conversion_cache
+from produtos import product_key, product_key_or_url
+from link_queue import item_subscribers
 import re
-from config import ADMIN_IDS
-from api_shopee import convert_shopee_links, resolve_short_link
-from database import save_video_db
+import time
+import asyncio
+from database import (
+    get_broadcast_job, list_broadcast_jobs, set_broadcast_status_message, unreachable_by_reason
+)
+from broadcast import (
+    run_and_report_broadcast_job, prepare_broadcast_job, pause_broadcast_job, is_job_running, job_progress_text,
+    claim_interrupted_preparation, resume_broadcast_preparation
+)
+from entregas import UNREACHABLE_REASONS
+from fanout import fan_out
+from gravacao import write_behind
+from suporte import support_tickets
+from progresso import LiveStatus
+
+def _batch_line(i: int, link) -> str:
+    """Linha de um produto no lote: número (emoji nos 6 primeiros), link convertido ou erro."""
+    number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣"]
+    if link is None:
+        return f"{i+1}. ⏳ a converter..."
+    if "Erro" in link:
+        return f"❌ {link}"
+    return f"{number_emojis[i]} {link}" if i < len(number_emojis) else f"{i+1}. {link}"
 
 async def add_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Processa links da fila e os envia formatados para o admin."""
+    """Processa links da fila (/add1 a /add6 ou /add <N>) e mostra-os ao admin à medida que são convertidos.
+
+    Os links em falta são convertidos em lotes de SHOPEE_BATCH_SIZE, vários em paralelo. A lista
+    é uma mensagem de estado editada a cada lote concluído e dividida em várias mensagens se
+    ultrapassar o limite de tamanho do Telegram.
+    """
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS: return
 
     try:
-        num_to_add = int(update.message.text.replace("/add", ""))
-    except ValueError:
+        command = update.message.text.split()[0].split('@')[0]
+        num_to_add = int(context.args[0]) if command == "/add" else int(command.replace("/add", ""))
+    except (ValueError, IndexError):
+        await update.message.reply_text("Comando inválido.")
+        return
+    if num_to_add < 1:
         await update.message.reply_text("Comando inválido.")
         return
 
-    fila = context.bot_data.get('link_queue', [])
-    if not fila:
+    fila = context.bot_data['link_queue']
+    # Os itens saem da fila logo (de forma atómica, também entre processos), para dois admins a usar
+    # /add ao mesmo tempo nunca receberem os mesmos produtos; o /cancelar devolve-os à fila
+    items_to_process = fila.pop_batch(num_to_add)
+    if not items_to_process:
         await update.message.reply_text("A fila de links dos utilizadores está vazia. ✅")
         return
+    num_to_process = len(items_to_process)
     
-    # Garante que não processamos mais links do que os que existem na fila
-    num_to_process = min(num_to_add, len(fila))
-    items_to_process = fila[:num_to_process]
-    
-    links_for_api = [item['original_link'] for item in items_to_process]
-    user_ids_to_notify = list(set([item['user_id'] for item in items_to_process]))
+    user_ids_to_notify = list({uid for item in items_to_process for uid in item_subscribers(item)})
     
     context.user_data['last_processed_items'] = items_to_process
     context.user_data['last_processed_user_ids'] = user_ids_to_notify
 
-    await update.message.reply_text(f"A converter {num_to_process} links, por favor aguarde...")
-    converted_links = convert_shopee_links(links_for_api)
-    
-    number_emojis = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣"]
-    formatted_message = "*Produtos do lote para vídeo:*\n"
-    for i, link in enumerate(converted_links):
-        link_escaped = escape_markdown(link, version=2)
-        if "Erro" in link:
-             formatted_message += f"❌ {link_escaped}\n"
-        elif i < len(number_emojis):
-            formatted_message += f"{number_emojis[i]} {link_escaped}\n"
-        else:
-            formatted_message += f"{i+1}\\. {link_escaped}\n"
-    
-    await update.message.reply_text(formatted_message, parse_mode=ParseMode.MARKDOWN_V2)
+    # Os links já pré-convertidos em segundo plano são usados diretamente; só os restantes vão à API
+    converted_links = [item.get('converted_link') for item in items_to_process]
+    missing = [i for i, link in enumerate(converted_links) if link is None]
+
+    def header() -> str:
+        prontos = sum(1 for link in converted_links if link is not None)
+        if prontos == num_to_process:
+            return f"Produtos do lote para vídeo ({num_to_process}):"
+        return f"Produtos do lote para vídeo ({prontos}/{num_to_process} convertidos):"
+
+    status = LiveStatus(
+        update.message, header(), [_batch_line(i, link) for i, link in enumerate(converted_links)], ADD_PROGRESS_INTERVAL
+    )
+    await status.render()
+
+    semaphore = asyncio.Semaphore(ADD_CONVERT_CONCURRENCY)
+
+    async def convert_chunk(indices):
+        async with semaphore:
+            results = await convert_shopee_links([items_to_process[i]['original_link'] for i in indices])
+        for i, result in zip(indices, results):
+            converted_links[i] = result
+            status.set_line(i, _batch_line(i, result))
+        status.set_header(header())
+
+    chunks = [missing[start:start + SHOPEE_BATCH_SIZE] for start in range(0, len(missing), SHOPEE_BATCH_SIZE)]
+    await asyncio.gather(*(convert_chunk(chunk) for chunk in chunks))
+    await status.finish(header())
 
-    context.bot_data['link_queue'] = fila[num_to_process:]
     # CORREÇÃO: Adicionada formatação e escape de caracteres
     mensagem_final = (
-        f"Pronto\! {num_to_process} links foram processados\. Restam {len(context.bot_data['link_queue'])}\.\n\n"
+        f"Pronto\! {num_to_process} links foram processados\. Restam {len(fila)}\.\n\n"
         "Agora, crie o vídeo e use o comando:\n`/video <link_do_video>`"
     )
     await update.message.reply_text(mensagem_final, parse_mode=ParseMode.MARKDOWN_V2)
@@ -60,8 +104,16 @@ async def add_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def pendentes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Informa o admin sobre a quantidade de links na fila principal."""
     if update.effective_user.id not in ADMIN_IDS: return
-    quantidade = len(context.bot_data.get('link_queue', []))
-    await update.message.reply_text(f"Existem {quantidade} links pendentes na fila. ⏳")
+    fila = context.bot_data['link_queue']
+    quantidade = len(fila)
+    prontos = sum(1 for item in fila if 'converted_link' in item)
+    com_erro = sum(1 for item in fila if 'conversion_error' in item and 'converted_link' not in item)
+    mensagem = f"Existem {quantidade} links pendentes na fila. ⏳"
+    if quantidade:
+        mensagem += f"\n\n⚡ Já convertidos: {prontos}"
+        if com_erro:
+            mensagem += f"\n❌ Com erro na conversão: {com_erro}"
+    await update.message.reply_text(mensagem)
 
 async def addmanual(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Inicia o modo de adição manual interativo."""
@@ -80,6 +132,11 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_user.id not in ADMIN_IDS: return
 
     user_state = context.user_data.get('state')
+
+    # /add <N>: lote de N links da fila, sem limite máximo
+    if context.args and context.args[0].isdigit():
+        await add_links(update, context)
+        return
     
     if user_state == 'awaiting_manual_links':
         if not context.args:
@@ -94,8 +151,8 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         link_to_add = context.args[0]
         
         msg = await update.message.reply_text(f"A adicionar e converter o link...")
-        resolved_link = resolve_short_link(link_to_add)
-        converted_link_list = convert_shopee_links([resolved_link])
+        resolved_link = await resolve_short_link(link_to_add)
+        converted_link_list = await convert_shopee_links([resolved_link])
         
         if not converted_link_list or "Erro" in converted_link_list[0]:
             error_msg = converted_link_list[0] if converted_link_list else 'Erro desconhecido'
@@ -125,8 +182,8 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     elif context.args:
         link_to_convert = context.args[0]
         await update.message.reply_text("A converter o link...")
-        resolved_link = resolve_short_link(link_to_convert)
-        converted_link_list = convert_shopee_links([resolved_link])
+        resolved_link = await resolve_short_link(link_to_convert)
+        converted_link_list = await convert_shopee_links([resolved_link])
         
         if converted_link_list and "Erro" not in converted_link_list[0]:
             link_escaped = escape_markdown(converted_link_list[0], version=2)
@@ -139,7 +196,8 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(
             "Uso do comando /add:\n\n"
             "1. Após usar `/addmanual`, para processar o lote.\n"
-            "2. Para converter um link na hora: `/add <link_da_shopee>`"
+            "2. Para converter um link na hora: `/add <link_da_shopee>`\n"
+            "3. Para processar N links da fila (sem limite): `/add <N>`"
         )
 
 async def video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -160,7 +218,7 @@ async def video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         if not original_manual_links:
             await update.message.reply_text("Você não adicionou nenhum link ao lote manual. Use `/add <link>` primeiro.")
             return
-        items_processed = [{'original_link': link, 'normalized_link': link.split('?')[0]} for link in original_manual_links]
+        items_processed = [{'original_link': link, 'normalized_link': product_key_or_url(link)} for link in original_manual_links]
         user_ids_to_notify = [user_id]
     
     elif 'last_processed_items' in context.user_data:
@@ -170,9 +228,11 @@ async def video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not items_processed:
         await update.message.reply_text("Você precisa de processar um lote com /add<N> ou iniciar um com /addmanual primeiro.")
         return
+    # O mesmo produto pode ter sido adicionado mais de uma vez (ou com formatos de URL diferentes)
+    items_processed = list({item['normalized_link']: item for item in items_processed}.values())
 
     await update.message.reply_text("A converter o link do vídeo...")
-    converted_video_link_list = convert_shopee_links([video_link_original])
+    converted_video_link_list = await convert_shopee_links([video_link_original])
 
     if not converted_video_link_list or "Erro" in converted_video_link_list[0]:
         await update.message.reply_text(f"Falha ao converter o link do vídeo. A API respondeu: {converted_video_link_list[0]}")
@@ -181,24 +241,20 @@ async def video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     converted_video_link = converted_video_link_list[0]
     
     video_db = context.bot_data['video_db']
-    for item in items_processed:
-        normalized_product_link = item['normalized_link']
-        video_db[normalized_product_link] = converted_video_link
-    save_video_db(video_db)
+    video_db.assign([item['normalized_link'] for item in items_processed], converted_video_link)
     
     if not user_ids_to_notify:
         await update.message.reply_text("Nenhum utilizador para notificar.")
     else:
-        sucesso = 0
-        falha = 0
-        for uid in user_ids_to_notify:
-            try:
-                mensagem = f"O vídeo do(s) produto(s) que você enviou está pronto! 🎬\n\nAssista aqui: {converted_video_link}"
-                await context.bot.send_message(chat_id=uid, text=mensagem)
-                sucesso += 1
-            except Exception as e:
-                falha += 1
-                print(f"Falha ao enviar vídeo para o ID {uid}: {e}")
+        mensagem = f"O vídeo do(s) produto(s) que você enviou está pronto! 🎬\n\nAssista aqui: {converted_video_link}"
+
+        async def send(uid):
+            await context.bot.send_message(chat_id=uid, text=mensagem)
+
+        result = await fan_out(user_ids_to_notify, send, record_delivery=True)
+        for uid, error in result.errors.items():
+            print(f"Falha ao enviar vídeo para o ID {uid}: {error}")
+        sucesso, falha = result.sucesso, result.falha
         
         link_escaped = escape_markdown(converted_video_link, version=2)
         if falha > 0:
@@ -227,7 +283,7 @@ async def cancelar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Modo de adição manual cancelado.")
     elif 'last_processed_items' in context.user_data:
         items_to_restore = context.user_data.pop('last_processed_items')
-        context.bot_data['link_queue'] = items_to_restore + context.bot_data.get('link_queue', [])
+        context.bot_data['link_queue'].push_front(items_to_restore)
         context.user_data.pop('last_processed_user_ids', None)
         await update.message.reply_text(f"Ação desfeita! ✅\n{len(items_to_restore)} links foram devolvidos ao início da fila de pendentes.")
     else:
@@ -270,22 +326,100 @@ async def enviar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("Nenhum utilizador registado para receber a mensagem.")
         return
 
-    sucesso = 0
-    falha = 0
-    await update.message.reply_text(f"A iniciar o envio para {len(all_user_ids)} utilizadores...")
+    # Os utilizadores e os resultados de entregas ainda por gravar contam para os destinatários
+    write_behind.flush()
+    job_id = await prepare_broadcast_job(user_id, message_to_send, photo_id)
+    total = get_broadcast_job(job_id)['total']
+    excluded = len(all_user_ids) - total
+    texto_inicio = f"A iniciar o envio #{job_id} para {total} utilizadores..."
+    if excluded:
+        texto_inicio += f"\n({excluded} inalcançáveis excluídos; ver /audiencia)"
+    status_message = await update.message.reply_text(texto_inicio)
+    set_broadcast_status_message(job_id, status_message.chat_id, status_message.message_id)
+
+    # O envio corre em segundo plano para não bloquear os comandos seguintes do admin (ex.: /pausar)
+    context.application.create_task(run_and_report_broadcast_job(context.bot, job_id))
+
+async def envios(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lista os envios em massa recentes ou mostra o estado de um envio (/envios <id>)."""
+    if update.effective_user.id not in ADMIN_IDS: return
 
-    for uid in all_user_ids:
+    if context.args:
         try:
-            if photo_id:
-                await context.bot.send_photo(chat_id=uid, photo=photo_id, caption=message_to_send)
-            else:
-                await context.bot.send_message(chat_id=uid, text=message_to_send)
-            sucesso += 1
-        except Exception as e:
-            falha += 1
-            print(f"Falha ao enviar para o ID {uid}: {e}")
+            job = get_broadcast_job(int(context.args[0]))
+        except ValueError:
+            job = None
+        if not job:
+            await update.message.reply_text("Envio não encontrado.")
+            return
+        texto = job['text'][:200] + ("..." if len(job['text']) > 200 else "")
+        await update.message.reply_text(
+            f"{job_progress_text(job)}\n"
+            f"Estado: {job['status']}{' (a decorrer)' if is_job_running(job['id']) else ''}\n"
+            f"Imagem: {'sim' if job['photo_id'] else 'não'}\n\n"
+            f"Mensagem:\n{texto}"
+        )
+        return
+
+    jobs = list_broadcast_jobs(limit=10)
+    if not jobs:
+        await update.message.reply_text("Ainda não foi feito nenhum envio.")
+        return
+    linhas = [
+        f"#{job['id']} · {job['status']} · {job['sent'] + job['failed']}/{job['total']}"
+        for job in jobs
+    ]
+    await update.message.reply_text(
+        "📬 Envios recentes:\n\n" + "\n".join(linhas) + "\n\nUse /envios <id> para ver detalhes."
+    )
+
+async def pausar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pausa um envio em massa (/pausar <id>); os destinatários pendentes ficam guardados."""
+    if update.effective_user.id not in ADMIN_IDS: return
 
-    await update.message.reply_text(f"Envio concluído!\n\n✅ Sucesso: {sucesso}\n❌ Falha: {falha}")
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Uso correto: /pausar <id_do_envio>")
+        return
+
+    job = get_broadcast_job(job_id)
+    if job and job['status'] == 'preparing':
+        await update.message.reply_text(f"O envio #{job_id} ainda está a ser preparado; tente de novo daqui a pouco.")
+    elif pause_broadcast_job(job_id):
+        await update.message.reply_text(f"Envio #{job_id} pausado. ⏸️\nUse /retomar {job_id} para continuar.")
+    else:
+        await update.message.reply_text("Envio não encontrado ou já concluído.")
+
+async def retomar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Retoma um envio em massa (/retomar <id>) apenas para quem ainda não o recebeu."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    try:
+        job_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("Uso correto: /retomar <id_do_envio>")
+        return
+
+    job = get_broadcast_job(job_id)
+    if not job or job['status'] == 'done':
+        await update.message.reply_text("Envio não encontrado ou já concluído.")
+        return
+    if job['status'] == 'preparing':
+        if not claim_interrupted_preparation(job):
+            await update.message.reply_text(f"O envio #{job_id} ainda está a ser preparado.")
+            return
+        status_message = await update.message.reply_text(f"A retomar a preparação do envio #{job_id}...")
+        set_broadcast_status_message(job_id, status_message.chat_id, status_message.message_id)
+        context.application.create_task(resume_broadcast_preparation(context.bot, job_id))
+        return
+    if is_job_running(job_id):
+        await update.message.reply_text(f"O envio #{job_id} já está a decorrer.")
+        return
+
+    status_message = await update.message.reply_text(f"A retomar o envio #{job_id}...\n\n{job_progress_text(job)}")
+    set_broadcast_status_message(job_id, status_message.chat_id, status_message.message_id)
+    context.application.create_task(run_and_report_broadcast_job(context.bot, job_id))
 
 async def deletar_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Deleta um vídeo da base de dados, desvinculando todos os produtos associados."""
@@ -298,24 +432,72 @@ async def deletar_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     
     video_link_to_delete = context.args[0]
-    video_db = context.bot_data.get('video_db', {})
+    video_db = context.bot_data['video_db']
     
-    keys_to_delete = [key for key, value in video_db.items() if value == video_link_to_delete]
+    keys_to_delete = video_db.delete_video(video_link_to_delete)
     
     if not keys_to_delete:
         await update.message.reply_text("Nenhum produto encontrado na base de dados associado a este link de vídeo.")
         return
-        
-    for key in keys_to_delete:
-        del video_db[key]
-        
-    save_video_db(video_db)
     
     await update.message.reply_text(
         f"Vídeo removido com sucesso! ✅\n\n"
         f"{len(keys_to_delete)} link(s) de produto(s) foram desvinculados e voltarão para a fila de pendentes se enviados novamente."
     )
 
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra as estatísticas da cache de conversões (quantas chamadas à API da Shopee foram poupadas)."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    stats = conversion_cache.stats()
+    await update.message.reply_text(
+        f"📊 Cache de conversões\n\n"
+        f"Links em cache: {stats['size']}/{stats['max_size']}\n"
+        f"✅ Acertos (chamadas poupadas): {stats['hits']}\n"
+        f"❌ Falhas (conversões na API): {stats['misses']}\n"
+        f"Taxa de acerto: {stats['hit_ratio']:.0%}"
+    )
+
+async def audiencia(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Mostra quantos utilizadores ainda recebem os envios e quantos foram excluídos por serem inalcançáveis."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    write_behind.flush()
+    registados = len(context.bot_data['user_ids'])
+    por_motivo = unreachable_by_reason()
+    ultima_semana = sum(unreachable_by_reason(time.time() - 7 * 24 * 3600).values())
+    inalcancaveis = sum(por_motivo.values())
+    alcancaveis = max(registados - inalcancaveis, 0)
+
+    mensagem = (
+        f"👥 Audiência dos envios em massa\n\n"
+        f"Registados: {registados}\n"
+        f"✅ Alcançáveis: {alcancaveis}\n"
+        f"🚫 Inalcançáveis (excluídos): {inalcancaveis}"
+    )
+    if registados:
+        mensagem += f" ({inalcancaveis / registados:.1%})"
+    for motivo, quantidade in sorted(por_motivo.items(), key=lambda item: -item[1]):
+        mensagem += f"\n   • {UNREACHABLE_REASONS.get(motivo, motivo)}: {quantidade}"
+    mensagem += f"\n\nNovos inalcançáveis nos últimos 7 dias: {ultima_semana}"
+    await update.message.reply_text(mensagem)
+
+async def produtos_video(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lista os produtos associados a um vídeo (/produtos <link_do_video>)."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    if not context.args:
+        await update.message.reply_text("Uso correto: /produtos <link_do_video>")
+        return
+
+    products = sorted(context.bot_data['video_db'].products_for(context.args[0]))
+    if not products:
+        await update.message.reply_text("Nenhum produto está associado a este link de vídeo.")
+        return
+    await update.message.reply_text(
+        f"🎬 {len(products)} produto(s) associado(s) a este vídeo:\n\n" + "\n".join(products)
+    )
+
 async def esgotado(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Lida com links esgotados."""
     await handle_problematic_link(update, context, "esgotado")
@@ -338,7 +520,10 @@ async def handle_problematic_link(update: Update, context: ContextTypes.DEFAULT_
         return
 
     problematic_link_admin = context.args[0]
-    normalized_link_admin = problematic_link_admin.split('?')[0]
+    # Aceita qualquer formato de link do produto (incluindo links encurtados)
+    normalized_link_admin = product_key(problematic_link_admin)
+    if normalized_link_admin is None:
+        normalized_link_admin = product_key_or_url(await resolve_short_link(problematic_link_admin))
     
     items_processed = context.user_data['last_processed_items']
     item_found = None
@@ -349,55 +534,106 @@ async def handle_problematic_link(update: Update, context: ContextTypes.DEFAULT_
             break
     
     if item_found:
-        user_to_notify = item_found['user_id']
+        users_to_notify = item_subscribers(item_found)
         
         if problem_type == "esgotado":
             message_to_user = "O produto que você enviou está esgotado. 😕\nObrigado pela sua contribuição!"
         else: # bugado
             message_to_user = "O produto que você enviou não é aceite pela Shopee para ser incluído em vídeos. 😥\nObrigado pela sua contribuição!"
 
-        try:
-            await context.bot.send_message(chat_id=user_to_notify, text=message_to_user)
-            
+        async def send(uid):
+            await context.bot.send_message(chat_id=uid, text=message_to_user)
+
+        result = await fan_out(users_to_notify, send, record_delivery=True)
+        notified = result.delivered
+        failures = [f"{uid}: {error}" for uid, error in result.errors.items()]
+
+        if notified:
             items_processed.remove(item_found)
-            user_ids_to_notify = list(set([i['user_id'] for i in items_processed]))
+            user_ids_to_notify = list({uid for i in items_processed for uid in item_subscribers(i)})
             context.user_data['last_processed_user_ids'] = user_ids_to_notify
             
-            await update.message.reply_text(f"Produto marcado como {problem_type}! ✅\nO utilizador {user_to_notify} foi notificado.")
-        except Exception as e:
-            await update.message.reply_text(f"Falha ao notificar o utilizador {user_to_notify}. Erro: {e}")
+            resposta = f"Produto marcado como {problem_type}! ✅\n{len(notified)} utilizador(es) notificado(s)."
+            if failures:
+                resposta += f"\n\n❌ Falha ao notificar {len(failures)}:\n" + "\n".join(failures)
+            await update.message.reply_text(resposta)
+        else:
+            await update.message.reply_text(f"Falha ao notificar os utilizadores. Erro(s):\n" + "\n".join(failures))
     else:
         await update.message.reply_text("Este link não foi encontrado no último lote de produtos processados.")
 
+async def tickets(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Lista os pedidos de suporte por fechar, os que esperam resposta há mais tempo primeiro."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    abertos = support_tickets.list_open()
+    if not abertos:
+        await update.message.reply_text("Não há pedidos de suporte por fechar. ✅")
+        return
+    agora = time.time()
+    linhas = ["📬 Pedidos de suporte por fechar:\n"]
+    for ticket in abertos:
+        estado = "⏳ à espera" if ticket['status'] == 'open' else "💬 respondido"
+        minutos = int((agora - ticket['updated_at']) // 60)
+        linhas.append(f"#{ticket['id']} · utilizador {ticket['user_id']} · {estado} há {minutos} min\n   {ticket['preview']}")
+    linhas.append("\nUse /fechar <id> (ou responda a uma mensagem do pedido com /fechar) para o fechar.")
+    await update.message.reply_text("\n".join(linhas))
+
+async def fechar(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Fecha um pedido de suporte, indicado pelo ID ou respondendo a uma mensagem da conversa."""
+    if update.effective_user.id not in ADMIN_IDS: return
+
+    ticket = None
+    if context.args and context.args[0].lstrip('#').isdigit():
+        ticket = support_tickets.get(int(context.args[0].lstrip('#')))
+    elif update.message.reply_to_message:
+        ticket = support_tickets.find(update.effective_chat.id, update.message.reply_to_message.message_id)
+    if ticket is None:
+        await update.message.reply_text("Uso: /fechar <id do pedido>, ou responda com /fechar a uma mensagem do pedido.")
+        return
+    support_tickets.close(ticket['id'])
+    await update.message.reply_text(f"Pedido #{ticket['id']} fechado. ✅")
+
 async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processa mensagens de administradores, principalmente para responder a pedidos de suporte."""
     message = update.message
 
-    if message.reply_to_message and "📩 *Nova mensagem de suporte de" in message.reply_to_message.text:
-        original_text = message.reply_to_message.text
-        
-        match = re.search(r"\[support_id=(\d+)\]", original_text)
-        
-        if match:
-            user_id_to_reply = int(match.group(1))
-            try:
-                # CORREÇÃO: Adiciona formatação à resposta do suporte
-                response_text = f"📨 *Resposta do Suporte:*\n\n{escape_markdown(message.text, version=2)}"
-                await context.bot.send_message(
-                    chat_id=user_id_to_reply,
-                    text=response_text,
-                    parse_mode=ParseMode.MARKDOWN_V2
-                )
+    # Qualquer mensagem da conversa (encaminhamento ou resposta anterior) identifica o pedido
+    ticket = None
+    user_id_to_reply = None
+    if message.reply_to_message:
+        ticket = support_tickets.find(message.chat_id, message.reply_to_message.message_id)
+        if ticket:
+            user_id_to_reply = ticket['user_id']
+        elif message.reply_to_message.text:
+            # Encaminhamentos anteriores ao registo de pedidos só têm o ID do utilizador no texto
+            match = re.search(r"\[support_id=(\d+)\]", message.reply_to_message.text)
+            if match:
+                user_id_to_reply = int(match.group(1))
+
+    if user_id_to_reply is not None:
+        try:
+            # CORREÇÃO: Adiciona formatação à resposta do suporte
+            response_text = f"📨 *Resposta do Suporte:*\n\n{escape_markdown(message.text, version=2)}"
+            await context.bot.send_message(
+                chat_id=user_id_to_reply,
+                text=response_text,
+                parse_mode=ParseMode.MARKDOWN_V2
+            )
+            if ticket:
+                support_tickets.mark_answered(ticket['id'])
+                support_tickets.link(ticket['id'], message.chat_id, message.message_id)
+                await update.message.reply_text(f"✅ A sua resposta foi enviada ao utilizador (pedido #{ticket['id']}).")
+            else:
                 await update.message.reply_text("✅ A sua resposta foi enviada ao utilizador.")
-            except Exception as e:
-                error_text = (
-                    "❌ *Falha ao enviar a resposta*\.\n\n"
-                    "*Possíveis causas:*\n"
-                    "1\. O utilizador pode ter bloqueado o bot\.\n"
-                    "2\. O utilizador nunca iniciou uma conversa privada com o bot \(envie\-lhe o link do bot e peça para ele enviar /start\)\."
-                )
-                await update.message.reply_text(error_text, parse_mode=ParseMode.MARKDOWN_V2)
-            return
+        except Exception as e:
+            error_text = (
+                "❌ *Falha ao enviar a resposta*\.\n\n"
+                "*Possíveis causas:*\n"
+                "1\. O utilizador pode ter bloqueado o bot\.\n"
+                "2\. O utilizador nunca iniciou uma conversa privada com o bot \(envie\-lhe o link do bot e peça para ele enviar /start\)\."
+            )
+            await update.message.reply_text(error_text, parse_mode=ParseMode.MARKDOWN_V2)
+        return
 
     await update.message.reply_text("Comando ou mensagem não reconhecido. Use uma das opções do menu ou responda a um pedido de suporte.")
-
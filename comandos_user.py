@@ -3,9 +3,96 @@ from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from telegram.helpers import escape_markdown
 import re
-from config import ADMIN_IDS
-from database import save_user_ids
+import asyncio
+import math
+from config import (
+    ADMIN_IDS, MAX_LINKS_PER_MESSAGE, QUEUE_SHED_DEPTH,
+    SUBMISSION_USER_RATE, SUBMISSION_USER_BURST, SUBMISSION_GLOBAL_RATE, SUBMISSION_GLOBAL_BURST
+)
 from api_shopee import resolve_short_link
+from produtos import product_key, product_key_or_url
+from entregas import delivery_ledger
+from fanout import fan_out
+from suporte import support_tickets
+from ratelimit import SubmissionLimiter
+from metrics import submissions_rejected
+
+# Limites de mensagens dos utilizadores (SUBMISSION_USER_RATE é por minuto)
+submission_limiter = SubmissionLimiter(
+    SUBMISSION_USER_RATE / 60, SUBMISSION_USER_BURST, SUBMISSION_GLOBAL_RATE, SUBMISSION_GLOBAL_BURST
+)
+
+async def _send_to_admins(bot, text: str, parse_mode=None, on_sent=None) -> None:
+    """Envia a mesma mensagem a todos os admins em paralelo; as falhas ficam apenas no log."""
+    async def send(admin_id):
+        sent = await bot.send_message(chat_id=admin_id, text=text, parse_mode=parse_mode)
+        if on_sent is not None:
+            on_sent(admin_id, sent)
+
+    result = await fan_out(ADMIN_IDS, send)
+    for admin_id, error in result.errors.items():
+        print(f"Falha ao notificar o admin {admin_id}: {error}")
+
+# Alertas da fila: só a mais recente fica à espera enquanto outra está a ser enviada
+_pending_alert = None
+_alert_running = False
+
+def notify_admins(context: ContextTypes.DEFAULT_TYPE, text: str) -> None:
+    """Envia um alerta aos admins em segundo plano, sem ocupar o worker que trata a atualização.
+
+    Os envios para o mesmo chat respeitam o intervalo mínimo do limitador do Telegram, por isso
+    vários alertas seguidos são juntados: é enviado apenas o último.
+    """
+    global _pending_alert, _alert_running
+    _pending_alert = text
+    if not _alert_running:
+        _alert_running = True
+        context.application.create_task(_send_alerts(context.bot))
+
+async def _send_alerts(bot) -> None:
+    global _pending_alert, _alert_running
+    try:
+        while _pending_alert is not None:
+            text, _pending_alert = _pending_alert, None
+            await _send_to_admins(bot, text)
+    finally:
+        _alert_running = False
+
+async def reject_if_limited(update: Update, user_id: int, cost: float = 1) -> bool:
+    """Aplica os limites de mensagens; se a mensagem for recusada avisa o utilizador (uma vez) e devolve True."""
+    reason = submission_limiter.check(user_id, cost)
+    if reason is None:
+        return False
+    submissions_rejected.inc(reason)
+    if submission_limiter.should_warn(user_id):
+        if reason == 'user':
+            segundos = math.ceil(submission_limiter.retry_after(user_id))
+            await update.message.reply_text(f"⏳ Está a enviar mensagens muito depressa. Tente de novo daqui a {segundos} segundos.")
+        else:
+            await update.message.reply_text("⏳ O bot está com muitos pedidos neste momento. Por favor, tente de novo daqui a alguns minutos.")
+    return True
+
+def forward_to_support(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Encaminha a mensagem do utilizador aos admins, registando cada cópia enviada no pedido de suporte."""
+    user = update.effective_user
+    message_text = update.message.text
+    ticket_id = support_tickets.open(user.id, message_text)
+    username = f"@{user.username}" if user.username else "Não tem"
+    forward_message = (
+        f"📩 *Nova mensagem de suporte de {escape_markdown(user.first_name, version=2)}* \\(pedido \\#{ticket_id}\\)\n\n"
+        f"*ID do Utilizador:* `{user.id}`\n"
+        f"*Username:* {escape_markdown(username, version=2)}\n"
+        f"---------------------------------\n"
+        f"{escape_markdown(message_text, version=2)}\n"
+        f"---------------------------------\n"
+        f"Para responder, use a função 'Responder' \\(Reply\\) do Telegram nesta mensagem\\."
+    )
+
+    # Em segundo plano: o utilizador recebe logo a confirmação e o worker fica livre
+    context.application.create_task(_send_to_admins(
+        context.bot, forward_message, ParseMode.MARKDOWN_V2,
+        on_sent=lambda admin_id, sent: support_tickets.link(ticket_id, admin_id, sent.message_id)
+    ))
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Regista o ID do utilizador, envia uma mensagem de boas-vindas e o menu apropriado."""
@@ -13,21 +100,27 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     context.user_data.clear()
     
     user_ids = context.bot_data['user_ids']
+    # Quem escreve ao bot voltou a estar alcançável (ex.: desbloqueou-o)
+    delivery_ledger.mark_reachable(user_id)
     if user_id not in user_ids:
         user_ids.add(user_id)
-        save_user_ids(user_ids)
         print(f"Novo utilizador registado permanentemente: {user_id}. Total: {len(user_ids)}")
 
     if user_id in ADMIN_IDS:
         # CORREÇÃO: Formatação Markdown V2 correta e ativação do parse_mode
         mensagem_start = (
             "*Olá, veja como utilizar os comandos*\n\n"
-            "🔹 */add1 a /add6*: Carrega produtos da fila\.\n"
+            "🔹 */add1 a /add6*, */add <N>*: Carrega produtos da fila \\(quantidade livre com /add <N>\\)\.\n"
             "🔹 */pendentes*: Mostra a quantidade de produtos na fila\.\n"
             "🔹 */addmanual*: Adiciona produtos manualmente\.\n"
             "🔹 */video <link>*: Envia o vídeo para os utilizadores do último lote\.\n"
             "🔹 */esgotado <link>*: Notifica o utilizador que o produto está esgotado\.\n"
             "🔹 */bugado <link>*: Notifica o utilizador que o produto está bugado\.\n"
+            "🔹 */produtos <link>*: Lista os produtos associados a um vídeo\.\n"
+            "🔹 */cache*: Mostra as estatísticas da cache de conversões\.\n"
+            "🔹 */envios*, */pausar <id>*, */retomar <id>*: Acompanha e controla os envios em massa\.\n"
+            "🔹 */audiencia*: Mostra quantos utilizadores foram excluídos dos envios por estarem inalcançáveis\.\n"
+            "🔹 */tickets*, */fechar <id>*: Lista e fecha os pedidos de suporte\.\n"
             "🔹 *Responder a uma mensagem de suporte encaminhada* para falar com o utilizador\."
         )
         admin_keyboard_layout = [
@@ -84,6 +177,69 @@ async def cupom(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
     await update.message.reply_text(mensagem, parse_mode=ParseMode.MARKDOWN_V2, disable_web_page_preview=True)
 
+# Resposta a uma submissão de um só link, por resultado de submit_product
+SUBMISSION_REPLIES = {
+    'video_link': "Este é um link de vídeo, não de produto. 😥\n\nPor favor, envie o link correto do produto. Use o /tutorial para saber como fazer.",
+    'not_product': "Este link não parece ser de um produto. 😕\n\nPor favor, copie o link novamente e me envie. Consulte o /tutorial ou /ajuda se tiver dúvidas.",
+    'has_video': "Já temos um vídeo para este produto! 🎬\n\nAssista aqui: {video}",
+    'already_queued': "Este produto já está na fila para análise. ✅\n\nVocê será avisado assim que o vídeo estiver pronto.",
+    'queued': "Obrigado! O seu produto foi adicionado à fila para análise. ✅",
+}
+
+def submit_product(context: ContextTypes.DEFAULT_TYPE, user_id: int, resolved_link: str) -> tuple:
+    """Classifica um link já resolvido e, se for um produto novo, põe-no na fila.
+
+    Devolve (resultado, detalhe): 'video_link' ou 'not_product' (rejeitado), 'has_video' (com o
+    link do vídeo), 'already_queued' ou 'queued' (com a chave do produto).
+    """
+    if "/video/" in resolved_link.lower():
+        return 'video_link', None
+
+    is_product_link = (
+        product_key(resolved_link) is not None or
+        "/item/" in resolved_link.lower()
+    )
+    if not is_product_link:
+        return 'not_product', None
+
+    video_db = context.bot_data['video_db']
+    # A chave canónica (shop_id.item_id) é a mesma para todos os formatos de URL do produto
+    normalized_link = product_key_or_url(resolved_link)
+    existing_video_link = video_db.get(normalized_link)
+    if existing_video_link is not None:
+        return 'has_video', existing_video_link
+
+    link_data = {'user_id': user_id, 'original_link': resolved_link, 'normalized_link': normalized_link}
+    if not context.bot_data['link_queue'].append(link_data):
+        # O produto já estava na fila: o utilizador será avisado junto com quem o enviou primeiro
+        return 'already_queued', normalized_link
+    return 'queued', normalized_link
+
+def submission_summary(links: list, results: list, ignored: list) -> str:
+    """Resposta única a uma mensagem com vários links, agrupada por resultado."""
+    videos = [video for status, video in results if status == 'has_video']
+    queued = sum(1 for status, _ in results if status == 'queued')
+    already_queued = sum(1 for status, _ in results if status == 'already_queued')
+    rejected = [(link, status) for link, (status, _) in zip(links, results) if status in ('video_link', 'not_product')]
+
+    linhas = [f"Recebi {len(links)} links. Resultado:"]
+    if videos:
+        linhas.append(f"\n🎬 Já têm vídeo ({len(videos)}):")
+        linhas.extend(f"• {video}" for video in dict.fromkeys(videos))
+    if queued:
+        linhas.append(f"\n✅ Adicionados à fila para análise: {queued}")
+    if already_queued:
+        linhas.append(f"⏳ Já estavam na fila: {already_queued}")
+    if queued or already_queued:
+        linhas.append("Você será avisado assim que os vídeos estiverem prontos.")
+    if rejected:
+        linhas.append(f"\n❌ Não são links de produto ({len(rejected)}):")
+        linhas.extend(f"• {link}{' (link de vídeo)' if status == 'video_link' else ''}" for link, status in rejected)
+        linhas.append("Consulte o /tutorial para saber como copiar o link correto.")
+    if ignored:
+        linhas.append(f"\n⚠️ Só são aceites {MAX_LINKS_PER_MESSAGE} links por mensagem; {len(ignored)} foram ignorados. Envie-os numa nova mensagem.")
+    return "\n".join(linhas)
+
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processa todas as mensagens de texto de utilizadores normais, distinguindo submissões de links de pedidos de suporte."""
     user = update.effective_user
@@ -92,106 +248,77 @@ async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Regista o ID do utilizador na base de dados se for a primeira vez
     user_ids = context.bot_data['user_ids']
+    # Quem escreve ao bot voltou a estar alcançável (ex.: desbloqueou-o)
+    delivery_ledger.mark_reachable(user_id)
     if user_id not in user_ids:
         user_ids.add(user_id)
-        save_user_ids(user_ids)
         print(f"Novo utilizador registado (via mensagem): {user_id}. Total: {len(user_ids)}")
 
-    # Procura por qualquer tipo de link da Shopee na mensagem
+    # Procura por todos os links da Shopee na mensagem (sem repetições, pela ordem em que aparecem)
     url_pattern = r'https?://[^\s]*(shopee|shp\.ee)[^\s]*'
-    match = re.search(url_pattern, message_text, re.IGNORECASE)
+    shopee_links = list(dict.fromkeys(match.group(0) for match in re.finditer(url_pattern, message_text, re.IGNORECASE)))
     
     # Se não encontrar nenhum link, trata como pedido de suporte
-    if not match:
+    if not shopee_links:
         # --- FLUXO DE SUPORTE (SEM LINK) ---
-        username = f"@{user.username}" if user.username else "Não tem"
-        magic_id_string = f"\n\n[support_id={user.id}]"
-        forward_message = (
-            f"📩 *Nova mensagem de suporte de {escape_markdown(user.first_name, version=2)}*\n\n"
-            f"*ID do Utilizador:* `{user.id}`\n"
-            f"*Username:* {escape_markdown(username, version=2)}\n"
-            f"---------------------------------\n"
-            f"{escape_markdown(message_text, version=2)}\n"
-            f"---------------------------------\n"
-            f"Para responder, use a função 'Responder' \(Reply\) do Telegram nesta mensagem\."
-            f"{magic_id_string}"
-        )
-        for admin_id in ADMIN_IDS:
-            try:
-                await context.bot.send_message(chat_id=admin_id, text=forward_message, parse_mode=ParseMode.MARKDOWN_V2)
-            except Exception as e:
-                print(f"Falha ao encaminhar mensagem para o admin {admin_id}: {e}")
+        if await reject_if_limited(update, user_id):
+            return
+        forward_to_support(update, context)
         await update.message.reply_text("✅ A sua mensagem foi enviada para o suporte. Responderemos assim que possível aqui mesmo no chat.")
         return
 
-    # Se encontrou um link, verifica se há texto adicional
-    shopee_link = match.group(0)
-    text_without_link = message_text.replace(shopee_link, '').strip()
+    # Se encontrou links, verifica se há texto adicional (removendo os links com o mesmo padrão, e
+    # não um a um, para um link que seja prefixo de outro não deixar restos no texto)
+    text_without_links = re.sub(url_pattern, '', message_text, flags=re.IGNORECASE)
 
     # Se há texto adicional, trata como suporte com link
-    if text_without_link:
+    if text_without_links.strip():
         # --- FLUXO DE SUPORTE (COM LINK) ---
-        username = f"@{user.username}" if user.username else "Não tem"
-        magic_id_string = f"\n\n[support_id={user.id}]"
-        forward_message = (
-            f"📩 *Nova mensagem de suporte de {escape_markdown(user.first_name, version=2)}*\n\n"
-            f"*ID do Utilizador:* `{user.id}`\n"
-            f"*Username:* {escape_markdown(username, version=2)}\n"
-            f"---------------------------------\n"
-            f"{escape_markdown(message_text, version=2)}\n"
-            f"---------------------------------\n"
-            f"Para responder, use a função 'Responder' \(Reply\) do Telegram nesta mensagem\."
-            f"{magic_id_string}"
-        )
-        for admin_id in ADMIN_IDS:
-            try:
-                await context.bot.send_message(chat_id=admin_id, text=forward_message, parse_mode=ParseMode.MARKDOWN_V2)
-            except Exception as e:
-                print(f"Falha ao encaminhar mensagem para o admin {admin_id}: {e}")
+        if await reject_if_limited(update, user_id):
+            return
+        forward_to_support(update, context)
         await update.message.reply_text("✅ A sua mensagem e o link foram enviados para o suporte. Responderemos assim que possível.")
         return
 
-    # Se não há texto adicional, é uma submissão de produto
-    else:
-        # --- FLUXO DE SUBMISSÃO DE PRODUTO ---
+    # --- FLUXO DE SUBMISSÃO DE PRODUTOS (UM OU VÁRIOS LINKS) ---
+    ignored = shopee_links[MAX_LINKS_PER_MESSAGE:]
+    shopee_links = shopee_links[:MAX_LINKS_PER_MESSAGE]
+    fila_atual = context.bot_data['link_queue']
+    # Com a fila acima do limite recusa logo, antes de qualquer pedido à rede
+    if QUEUE_SHED_DEPTH and len(fila_atual) >= QUEUE_SHED_DEPTH:
+        submissions_rejected.inc('queue_full')
+        await update.message.reply_text("⏳ A fila de análise está cheia neste momento. Por favor, tente de novo mais tarde.")
+        return
+    # Cada link custa uma ficha: é um pedido de resolução à Shopee
+    if await reject_if_limited(update, user_id, len(shopee_links)):
+        return
+    if len(shopee_links) == 1:
         processing_message = await update.message.reply_text("A verificar o seu link, por favor aguarde...")
-        
-        resolved_link = resolve_short_link(shopee_link) 
-        
-        if "/video/" in resolved_link.lower():
-            await processing_message.edit_text("Este é um link de vídeo, não de produto. 😥\n\nPor favor, envie o link correto do produto. Use o /tutorial para saber como fazer.")
-            return
+    else:
+        processing_message = await update.message.reply_text(f"A verificar os seus {len(shopee_links)} links, por favor aguarde...")
 
-        is_product_link = (
-            "/product/" in resolved_link.lower() or
-            "/item/" in resolved_link.lower() or
-            "affiliation-i." in resolved_link.lower() or
-            "-i." in resolved_link.lower() or
-            re.search(r'/\w+/\d+/\d+', resolved_link)
-        )
+    # Os redirecionamentos são resolvidos todos em paralelo; o registo na fila é feito depois, por ordem
+    resolved_links = await asyncio.gather(*(resolve_short_link(link) for link in shopee_links))
+    quantidade_anterior = len(fila_atual)
+    results = [submit_product(context, user_id, link) for link in resolved_links]
 
-        if not is_product_link:
-            await processing_message.edit_text("Este link não parece ser de um produto. 😕\n\nPor favor, copie o link novamente e me envie. Consulte o /tutorial ou /ajuda se tiver dúvidas.")
-            return
+    if len(results) == 1:
+        status, video_link = results[0]
+        await processing_message.edit_text(SUBMISSION_REPLIES[status].format(video=video_link))
+    else:
+        await processing_message.edit_text(submission_summary(shopee_links, results, ignored))
 
-        video_db = context.bot_data['video_db']
-        normalized_link = resolved_link.split('?')[0]
+    queued = [key for status, key in results if status == 'queued']
+    if queued:
+        preconverter = context.bot_data['preconverter']
+        for key in queued:
+            preconverter.schedule(key)
 
-        if normalized_link in video_db:
-            existing_video_link = video_db[normalized_link]
-            await processing_message.edit_text(f"Já temos um vídeo para este produto! 🎬\n\nAssista aqui: {existing_video_link}")
-        else:
-            link_data = {'user_id': user_id, 'original_link': resolved_link, 'normalized_link': normalized_link}
-            context.bot_data.setdefault('link_queue', []).append(link_data)
-            await processing_message.edit_text("Obrigado! O seu produto foi adicionado à fila para análise. ✅")
-
-            fila_atual = context.bot_data.get('link_queue', [])
-            nova_quantidade = len(fila_atual)
-            if nova_quantidade > 0 and nova_quantidade % 6 == 0:
-                mensagem_notificacao = f"🔔 Alerta! A fila de pendentes atingiu {nova_quantidade} produtos. Usem /add6 para processar o lote."
-                for admin_id in ADMIN_IDS:
-                    try:
-                        await context.bot.send_message(chat_id=admin_id, text=mensagem_notificacao)
-                    except Exception as e:
-                        print(f"Falha ao notificar o admin {admin_id}: {e}")
+        # Alerta sempre que a fila passa por um múltiplo de 6 produtos
+        nova_quantidade = len(fila_atual)
+        if nova_quantidade // 6 > quantidade_anterior // 6:
+            mensagem_notificacao = f"🔔 Alerta! A fila de pendentes atingiu {nova_quantidade} produtos. Usem /add6 para processar o lote."
+            notify_admins(context, mensagem_notificacao)
 
+        # A conversão para link de afiliado acontece em segundo plano, sem atrasar a resposta
+        preconverter.wake()
@@ -5,6 +5,8 @@ import re
 # Esta é a forma segura de ler as suas senhas na Replit
 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
+# Endereço da Bot API (o token é acrescentado no fim); pode apontar para um servidor local ou de testes
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
 SHOPEE_APP_ID = os.getenv("SHOPEE_APP_ID")
 SHOPEE_SECRET = os.getenv("SHOPEE_SECRET")
 
@@ -17,15 +19,109 @@ except ValueError:
     print("AVISO: A variável ADMIN_IDS contém um valor inválido. Apenas IDs numéricos são permitidos.")
     ADMIN_IDS = []
 
-# Nomes dos ficheiros de base de dados
+# Base de dados SQLite (vídeos, utilizadores e envios em massa)
+BOT_DB_FILE = os.getenv("BOT_DB_FILE", 'bot.db')
+# Ficheiros JSON antigos, importados uma única vez para a base de dados SQLite
 VIDEO_DB_FILE = 'video_database.json'
 USER_DB_FILE = 'user_ids.json'
+# Snapshot binário dos IDs de utilizadores (carregado com uma única leitura ao arrancar)
+USER_SNAPSHOT_FILE = os.getenv("USER_SNAPSHOT_FILE", 'user_ids.bin')
+# Onde fica o estado (catálogo, fila, utilizadores, user_data): "memory" mantém cópias em memória
+# (apenas um processo); "sqlite" lê e escreve tudo na base de dados, para vários workers do gunicorn
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+# Utilizadores novos e alterações do catálogo são gravados em grupo: quando houver
+# WRITE_BEHIND_MAX_PENDING pendentes ou WRITE_BEHIND_MAX_DELAY segundos depois da primeira
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))
+WRITE_BEHIND_MAX_DELAY = float(os.getenv("WRITE_BEHIND_MAX_DELAY", "2"))
+
+# --- SERVIDOR WEBHOOK ---
+# Token secreto configurado no setWebhook (secret_token); se vazio, o cabeçalho não é verificado
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Número de atualizações processadas em paralelo (as do mesmo chat são sempre sequenciais)
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+# Tempo máximo (segundos) para terminar as atualizações pendentes ao desligar
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+# Janela (segundos) e número máximo de update_id recentes lembrados para descartar entregas repetidas
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", str(6 * 3600)))
+DEDUP_MAX_SIZE = int(os.getenv("DEDUP_MAX_SIZE", "100000"))
+
+# --- LIGAÇÕES HTTP À SHOPEE ---
+# Tempos limite (em segundos) e tamanho do pool de ligações partilhado pelo cliente assíncrono
+SHOPEE_API_URL = os.getenv("SHOPEE_API_URL", "https://open-api.affiliate.shopee.com.br/graphql")
+SHOPEE_CONNECT_TIMEOUT = float(os.getenv("SHOPEE_CONNECT_TIMEOUT", "5"))
+SHOPEE_READ_TIMEOUT = float(os.getenv("SHOPEE_READ_TIMEOUT", "15"))
+RESOLVE_TIMEOUT = float(os.getenv("RESOLVE_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+# Número máximo de mutações generateShortLink enviadas num único documento GraphQL
+SHOPEE_BATCH_SIZE = int(os.getenv("SHOPEE_BATCH_SIZE", "20"))
+
+# --- CACHE DE CONVERSÕES ---
+# Links de afiliado já gerados, guardados em disco para sobreviverem a reinícios
+CONVERSION_CACHE_FILE = 'conversion_cache.json'
+CONVERSION_CACHE_MAX_SIZE = int(os.getenv("CONVERSION_CACHE_MAX_SIZE", "5000"))
+CONVERSION_CACHE_TTL = int(os.getenv("CONVERSION_CACHE_TTL", str(7 * 24 * 3600)))
+# Intervalo máximo (segundos) entre uma conversão nova e a gravação do ficheiro
+CONVERSION_CACHE_SAVE_INTERVAL = float(os.getenv("CONVERSION_CACHE_SAVE_INTERVAL", "60"))
+
+# --- CACHE DE REDIRECIONAMENTOS ---
+# Link encurtado -> URL final; as falhas ficam em cache por pouco tempo para não repetir timeouts
+RESOLVE_CACHE_MAX_SIZE = int(os.getenv("RESOLVE_CACHE_MAX_SIZE", "10000"))
+RESOLVE_CACHE_TTL = int(os.getenv("RESOLVE_CACHE_TTL", str(24 * 3600)))
+RESOLVE_NEGATIVE_TTL = int(os.getenv("RESOLVE_NEGATIVE_TTL", "60"))
+
+# --- SUBMISSÕES DE PRODUTOS ---
+# Número máximo de links processados numa só mensagem de um utilizador (os restantes são ignorados)
+MAX_LINKS_PER_MESSAGE = int(os.getenv("MAX_LINKS_PER_MESSAGE", "20"))
+# Limite por utilizador: mensagens (ou links) por minuto e pico permitido; o suporte também conta
+SUBMISSION_USER_RATE = float(os.getenv("SUBMISSION_USER_RATE", "10"))
+SUBMISSION_USER_BURST = float(os.getenv("SUBMISSION_USER_BURST", "20"))
+# Limite global (todos os utilizadores): links por segundo e pico permitido
+SUBMISSION_GLOBAL_RATE = float(os.getenv("SUBMISSION_GLOBAL_RATE", "20"))
+SUBMISSION_GLOBAL_BURST = float(os.getenv("SUBMISSION_GLOBAL_BURST", "100"))
+# Com a fila de pendentes a partir deste tamanho as submissões novas são recusadas (0 = sem limite)
+QUEUE_SHED_DEPTH = int(os.getenv("QUEUE_SHED_DEPTH", "5000"))
+
+# --- PRÉ-CONVERSÃO DA FILA ---
+# Número máximo de pedidos de conversão em paralelo feitos em segundo plano
+PRECONVERT_CONCURRENCY = int(os.getenv("PRECONVERT_CONCURRENCY", "2"))
+# Com vários workers, cada item é reservado por um só processo durante este tempo (segundos) enquanto é convertido
+PRECONVERT_CLAIM_TTL = float(os.getenv("PRECONVERT_CLAIM_TTL", "300"))
+
+# --- LOTES PARA VÍDEO (/add1 a /add6, /add <N>) ---
+# Lotes de conversão (de SHOPEE_BATCH_SIZE links) feitos em paralelo e intervalo mínimo (segundos)
+# entre edições da mensagem de estado, para respeitar o limite de edições do Telegram
+ADD_CONVERT_CONCURRENCY = int(os.getenv("ADD_CONVERT_CONCURRENCY", "4"))
+ADD_PROGRESS_INTERVAL = float(os.getenv("ADD_PROGRESS_INTERVAL", "2"))
+
+# --- ENVIOS PARA VÁRIOS DESTINATÁRIOS (suporte, notificações de vídeos) ---
+# Número máximo de mensagens enviadas em paralelo por cada operação
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "10"))
+
+# --- PEDIDOS DE SUPORTE ---
+# Tempo (segundos) sem atividade ao fim do qual um pedido e as suas mensagens são esquecidos
+SUPPORT_TICKET_RETENTION = int(os.getenv("SUPPORT_TICKET_RETENTION", str(30 * 24 * 3600)))
+
+# --- ENVIOS EM MASSA (/enviar) ---
+# O Telegram aceita ~30 mensagens/segundo por bot e ~1 mensagem/segundo por chat
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Cada envio é reservado por um processo durante BROADCAST_LEASE segundos, renovado enquanto decorre;
+# se o processo morrer, outro retoma o envio quando a reserva expirar
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "30"))
+# Os destinatários de um envio novo são registados em blocos deste tamanho, devolvendo o event loop entre blocos
+BROADCAST_PREPARE_CHUNK = int(os.getenv("BROADCAST_PREPARE_CHUNK", "5000"))
 
 # --- VALIDAÇÃO DAS CONFIGURAÇÕES ---
 # Verifica se as senhas essenciais foram carregadas corretamente
 
 if not TOKEN:
     raise ValueError("ERRO CRÍTICO: O TELEGRAM_TOKEN não foi encontrado nos Secrets. O bot não pode iniciar.")
+if STATE_BACKEND not in ("memory", "sqlite"):
+    raise ValueError(f"ERRO CRÍTICO: STATE_BACKEND inválido ({STATE_BACKEND}); use 'memory' ou 'sqlite'.")
 if not SHOPEE_APP_ID:
     print("AVISO: O SHOPEE_APP_ID não foi encontrado nos Secrets.")
 if not SHOPEE_SECRET:
@@ -1,33 +1,671 @@
 import json
 import os
-from config import VIDEO_DB_FILE, USER_DB_FILE
-
-def load_video_db():
-    """Carrega a base de dados de vídeos do ficheiro JSON."""
-    if os.path.exists(VIDEO_DB_FILE):
-        with open(VIDEO_DB_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                return {} # Retorna um dicionário vazio se o ficheiro estiver corrompido ou vazio
-    return {}
-
-def save_video_db(data):
-    """Guarda a base de dados de vídeos no ficheiro JSON."""
-    with open(VIDEO_DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def load_user_ids():
-    """Carrega o conjunto de IDs de utilizadores do ficheiro JSON."""
-    if os.path.exists(USER_DB_FILE):
-        with open(USER_DB_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return set(json.load(f))
-            except json.JSONDecodeError:
-                return set()
-    return set()
+import sqlite3
+import time
+from contextlib import contextmanager
+from config import VIDEO_DB_FILE, USER_DB_FILE, BOT_DB_FILE
+from produtos import product_key
+
+# --- BASE DE DADOS SQLITE ---
+# Uma única ligação partilhada, em modo WAL: cada alteração é uma transação atómica e incremental
+
+_connection = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS video_urls (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS product_videos (
+    product TEXT PRIMARY KEY,
+    video_id INTEGER NOT NULL REFERENCES video_urls (id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS product_videos_by_video ON product_videos (video_id);
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS link_queue (
+    seq INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    user_id INTEGER PRIMARY KEY,
+    last_success REAL,
+    last_failure REAL,
+    failure_reason TEXT,
+    unreachable_since REAL
+);
+CREATE INDEX IF NOT EXISTS deliveries_unreachable ON deliveries (unreachable_since) WHERE unreachable_since IS NOT NULL;
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS support_tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    opened_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    preview TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS support_tickets_by_user ON support_tickets (user_id, status);
+CREATE TABLE IF NOT EXISTS support_messages (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    ticket_id INTEGER NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS support_messages_by_ticket ON support_messages (ticket_id);
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id INTEGER PRIMARY KEY,
+    received_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    created_by INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    photo_id TEXT,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    status_chat_id INTEGER,
+    status_message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (job_id, user_id)
+) WITHOUT ROWID;
+"""
+
+def _fetch_dicts(sql: str, params=()) -> list:
+    """Executa uma consulta e devolve as linhas como dicionários (coluna -> valor)."""
+    cursor = get_connection().execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def get_connection() -> sqlite3.Connection:
+    """Abre (uma vez) a base de dados SQLite em modo WAL e cria as tabelas em falta."""
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(BOT_DB_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(SCHEMA)
+        _migrate_schema(_connection)
+        _migrate_json_files(_connection)
+    return _connection
+
+_transaction_depth = 0
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """Transação explícita; as funções de escrita chamadas lá dentro fazem parte dela (sem commits intermédios).
+
+    Com `immediate=True` o bloqueio de escrita é obtido logo no início, o que torna seguras as
+    sequências ler-depois-escrever quando vários processos partilham a base de dados.
+    """
+    global _transaction_depth
+    conn = get_connection()
+    if _transaction_depth:
+        _transaction_depth += 1
+        try:
+            yield conn
+        finally:
+            _transaction_depth -= 1
+        return
+
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    _transaction_depth = 1
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _transaction_depth = 0
+
+def _load_json_file(path):
+    """Lê um ficheiro JSON antigo; devolve None se não existir ou estiver corrompido."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            print(f"AVISO: {path} está corrompido e não foi migrado para a base de dados.")
+            return None
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+def _link_products(conn: sqlite3.Connection, products, video_url: str) -> int:
+    """Associa produtos a um vídeo (criando o vídeo se preciso) e devolve o ID do vídeo."""
+    conn.execute("INSERT OR IGNORE INTO video_urls (url) VALUES (?)", (video_url,))
+    video_id = conn.execute("SELECT id FROM video_urls WHERE url = ?", (video_url,)).fetchone()[0]
+    conn.executemany(
+        "INSERT OR REPLACE INTO product_videos (product, video_id) VALUES (?, ?)",
+        ((product, video_id) for product in products)
+    )
+    return video_id
+
+def _insert_users(conn: sqlite3.Connection, user_ids) -> None:
+    """Insere utilizadores novos, cada um com o próximo número de registo (seq); os existentes são ignorados."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO users (user_id, seq) VALUES (?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM users))",
+        ((uid,) for uid in user_ids)
+    )
+
+def _migrate_json_files(conn: sqlite3.Connection) -> None:
+    """Importa uma única vez os antigos video_database.json/user_ids.json e renomeia-os para *.migrated."""
+    if conn.execute("SELECT 1 FROM product_videos LIMIT 1").fetchone() is None:
+        videos = _load_json_file(VIDEO_DB_FILE)
+        if videos is not None:
+            with conn:
+                for product, video_url in videos.items():
+                    _link_products(conn, [product_key(product) or product], video_url)
+            os.replace(VIDEO_DB_FILE, f"{VIDEO_DB_FILE}.migrated")
+            print(f"{len(videos)} vídeos migrados de {VIDEO_DB_FILE} para a base de dados.")
+
+    if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+        user_ids = _load_json_file(USER_DB_FILE)
+        if user_ids is not None:
+            with conn:
+                _insert_users(conn, (int(uid) for uid in user_ids))
+            os.replace(USER_DB_FILE, f"{USER_DB_FILE}.migrated")
+            print(f"{len(user_ids)} utilizadores migrados de {USER_DB_FILE} para a base de dados.")
+
+def _rekey_products(conn: sqlite3.Connection) -> None:
+    """Migração 1: troca as chaves "URL sem parâmetros" pela chave canónica "<shop_id>.<item_id>"."""
+    renamed = 0
+    # A tabela "videos" só existe em bases de dados anteriores ao catálogo normalizado (migração 3)
+    legacy_videos = conn.execute("SELECT product, video_url FROM videos").fetchall() if _table_exists(conn, 'videos') else []
+    for product, video_url in legacy_videos:
+        key = product_key(product)
+        if key and key != product:
+            # Se o produto já existir com a chave nova, mantém-se essa associação
+            conn.execute("INSERT OR IGNORE INTO videos (product, video_url) VALUES (?, ?)", (key, video_url))
+            conn.execute("DELETE FROM videos WHERE product = ?", (product,))
+            renamed += 1
+    for seq, data in conn.execute("SELECT seq, data FROM link_queue").fetchall():
+        item = json.loads(data)
+        key = product_key(item.get('original_link', ''))
+        if key and item.get('normalized_link') != key:
+            item['normalized_link'] = key
+            conn.execute("UPDATE link_queue SET data = ? WHERE seq = ?", (json.dumps(item, ensure_ascii=False), seq))
+    if renamed:
+        print(f"{renamed} produtos da base de dados de vídeos migrados para a chave canónica.")
+
+def _coalesce_queue(conn: sqlite3.Connection) -> None:
+    """Migração 2: junta os itens repetidos da fila num só, com a lista de todos os utilizadores que o pediram."""
+    first_by_key = {} # chave do produto -> (seq, item) da primeira ocorrência
+    for seq, data in conn.execute("SELECT seq, data FROM link_queue ORDER BY seq").fetchall():
+        item = json.loads(data)
+        item.setdefault('subscribers', [item['user_id']])
+        first = first_by_key.get(item['normalized_link'])
+        if first is None:
+            first_by_key[item['normalized_link']] = (seq, item)
+            continue
+        for uid in item['subscribers']:
+            if uid not in first[1]['subscribers']:
+                first[1]['subscribers'].append(uid)
+        conn.execute("DELETE FROM link_queue WHERE seq = ?", (seq,))
+    for seq, item in first_by_key.values():
+        conn.execute("UPDATE link_queue SET data = ? WHERE seq = ?", (json.dumps(item, ensure_ascii=False), seq))
+
+def _normalize_videos(conn: sqlite3.Connection) -> None:
+    """Migração 3: passa a antiga tabela "videos" (produto -> URL) para video_urls + product_videos."""
+    if not _table_exists(conn, 'videos'):
+        return
+    by_url = {}
+    for product, video_url in conn.execute("SELECT product, video_url FROM videos").fetchall():
+        by_url.setdefault(video_url, []).append(product)
+    for video_url, products in by_url.items():
+        _link_products(conn, products, video_url)
+    conn.execute("DROP TABLE videos")
+    print(f"Catálogo de vídeos normalizado: {len(by_url)} vídeos distintos.")
+
+def _shared_state_columns(conn: sqlite3.Connection) -> None:
+    """Migração 4: colunas para o estado partilhado entre processos.
+
+    - link_queue.product: chave do produto indexada, para encontrar repetidos sem ler a fila toda
+    - broadcast_jobs.owner/lease_until: o processo que está a executar o envio e até quando
+    """
+    conn.execute("ALTER TABLE link_queue ADD COLUMN product TEXT")
+    conn.execute("UPDATE link_queue SET product = json_extract(data, '$.normalized_link')")
+    conn.execute("CREATE INDEX IF NOT EXISTS link_queue_by_product ON link_queue (product)")
+    conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN owner TEXT")
+    conn.execute("ALTER TABLE broadcast_jobs ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+
+def _user_registration_order(conn: sqlite3.Connection) -> None:
+    """Migração 5: users.seq, a ordem de registo, que permite carregar só os utilizadores posteriores a um snapshot."""
+    conn.execute("ALTER TABLE users ADD COLUMN seq INTEGER")
+    conn.execute("UPDATE users SET seq = rowid")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_by_seq ON users (seq)")
+
+# Migrações por ordem; a versão aplicada fica guardada em PRAGMA user_version
+MIGRATIONS = [
+    _rekey_products,
+    _coalesce_queue,
+    _normalize_videos,
+    _shared_state_columns,
+    _user_registration_order,
+]
+
+def _migrate_schema(conn: sqlite3.Connection) -> None:
+    """Aplica, cada uma na sua transação, as migrações ainda não aplicadas a esta base de dados.
+
+    O BEGIN é explícito: sem ele o sqlite3 do Python executa os ALTER TABLE fora da transação, e
+    uma migração que falhasse a meio deixaria colunas novas sem avançar o user_version (e o
+    arranque seguinte falharia com "duplicate column name"). A versão é relida já com o bloqueio
+    de escrita, para dois workers a arrancar ao mesmo tempo não aplicarem a mesma migração.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return
+            MIGRATIONS[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+# --- VÍDEOS E UTILIZADORES ---
+
+def load_video_catalog():
+    """Carrega o catálogo de vídeos: lista de (id, url) e lista de (produto, id do vídeo)."""
+    conn = get_connection()
+    videos = conn.execute("SELECT id, url FROM video_urls").fetchall()
+    links = conn.execute("SELECT product, video_id FROM product_videos").fetchall()
+    return videos, links
+
+def assign_video(products, video_url: str, orphaned_video_ids=None) -> int:
+    """Associa um vídeo a vários produtos numa só transação e devolve o ID do vídeo.
+
+    `orphaned_video_ids` são vídeos que deixaram de ter produtos e são removidos na mesma transação;
+    se não forem indicados, são calculados a partir da base de dados.
+    """
+    products = list(dict.fromkeys(products))
+    with transaction(immediate=True) as conn:
+        if orphaned_video_ids is None:
+            placeholders = ",".join("?" * len(products))
+            previous = {row[0] for row in conn.execute(
+                f"SELECT DISTINCT video_id FROM product_videos WHERE product IN ({placeholders})", products
+            )}
+        video_id = _link_products(conn, products, video_url)
+        if orphaned_video_ids is None:
+            orphaned_video_ids = [
+                vid for vid in previous
+                if conn.execute("SELECT 1 FROM product_videos WHERE video_id = ? LIMIT 1", (vid,)).fetchone() is None
+            ]
+        conn.executemany("DELETE FROM video_urls WHERE id = ?", ((vid,) for vid in orphaned_video_ids if vid != video_id))
+    return video_id
+
+def delete_video(video_id: int) -> None:
+    """Remove um vídeo e todas as associações de produtos a ele."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM product_videos WHERE video_id = ?", (video_id,))
+        conn.execute("DELETE FROM video_urls WHERE id = ?", (video_id,))
+
+def delete_video_url(video_url: str) -> None:
+    """Remove um vídeo (indicado pelo URL) e todas as associações de produtos a ele."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM product_videos WHERE video_id = (SELECT id FROM video_urls WHERE url = ?)", (video_url,))
+        conn.execute("DELETE FROM video_urls WHERE url = ?", (video_url,))
+
+def find_video(product: str):
+    """URL do vídeo associado a um produto, ou None."""
+    row = get_connection().execute(
+        "SELECT v.url FROM product_videos p JOIN video_urls v ON v.id = p.video_id WHERE p.product = ?", (product,)
+    ).fetchone()
+    return row[0] if row else None
+
+def video_products(video_url: str) -> list:
+    """Produtos associados a um URL de vídeo."""
+    rows = get_connection().execute(
+        "SELECT p.product FROM product_videos p JOIN video_urls v ON v.id = p.video_id WHERE v.url = ?", (video_url,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def find_video_id(video_url: str):
+    row = get_connection().execute("SELECT id FROM video_urls WHERE url = ?", (video_url,)).fetchone()
+    return row[0] if row else None
+
+def count_catalog() -> tuple:
+    """Devolve (número de produtos com vídeo, número de vídeos)."""
+    conn = get_connection()
+    return (
+        conn.execute("SELECT COUNT(*) FROM product_videos").fetchone()[0],
+        conn.execute("SELECT COUNT(*) FROM video_urls").fetchone()[0],
+    )
 
 def save_user_ids(data):
-    """Guarda o conjunto de IDs de utilizadores no ficheiro JSON."""
-    with open(USER_DB_FILE, 'w', encoding='utf-8') as f:
-        json.dump(list(data), f, indent=4)
+    """Garante que todos os IDs de `data` estão guardados (os já existentes são ignorados)."""
+    with transaction() as conn:
+        _insert_users(conn, data)
+
+def user_ids_since(seq: int) -> tuple:
+    """Utilizadores registados depois do número de registo `seq`; devolve (IDs, último seq)."""
+    rows = get_connection().execute("SELECT user_id, seq FROM users WHERE seq > ? ORDER BY seq", (seq,)).fetchall()
+    return [row[0] for row in rows], (rows[-1][1] if rows else seq)
+
+def has_user_id(user_id: int) -> bool:
+    return get_connection().execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+def count_user_ids() -> int:
+    return get_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+def iter_user_ids():
+    """Percorre os IDs de utilizadores por ordem crescente, sem os carregar todos para uma lista."""
+    return (row[0] for row in get_connection().execute("SELECT user_id FROM users ORDER BY user_id"))
+
+def max_user_seq() -> int:
+    """Número de registo do último utilizador gravado (0 se não houver nenhum)."""
+    return get_connection().execute("SELECT COALESCE(MAX(seq), 0) FROM users").fetchone()[0]
+
+# --- FILA DE LINKS PENDENTES ---
+# Cada item tem um número de sequência: o início da fila é o menor, o fim o maior.
+
+def load_link_queue() -> list:
+    """Carrega a fila de links pendentes como lista de (seq, item), por ordem."""
+    rows = get_connection().execute("SELECT seq, data FROM link_queue ORDER BY seq").fetchall()
+    return [(seq, json.loads(data)) for seq, data in rows]
+
+def insert_queue_items(entries) -> None:
+    """Guarda itens (seq, item) na fila, numa só transação."""
+    with transaction() as conn:
+        conn.executemany(
+            "INSERT INTO link_queue (seq, product, data) VALUES (?, ?, ?)",
+            ((seq, item['normalized_link'], json.dumps(item, ensure_ascii=False)) for seq, item in entries)
+        )
+
+def update_queue_item(seq: int, item: dict) -> None:
+    """Regrava um item da fila (ex.: quando mais um utilizador submete o mesmo produto)."""
+    with transaction() as conn:
+        conn.execute("UPDATE link_queue SET data = ? WHERE seq = ?", (json.dumps(item, ensure_ascii=False), seq))
+
+def queue_length() -> int:
+    return get_connection().execute("SELECT COUNT(*) FROM link_queue").fetchone()[0]
+
+def queue_head(n: int) -> list:
+    """Os primeiros `n` itens da fila como lista de (seq, item)."""
+    rows = get_connection().execute("SELECT seq, data FROM link_queue ORDER BY seq LIMIT ?", (n,)).fetchall()
+    return [(seq, json.loads(data)) for seq, data in rows]
+
+def claim_queue_head(n: int) -> list:
+    """Retira e devolve os primeiros `n` itens da fila numa só transação IMMEDIATE.
+
+    Ler e apagar na mesma transação garante que dois processos nunca recebem os mesmos itens
+    nem apagam itens que o outro não viu.
+    """
+    with transaction(immediate=True):
+        batch = queue_head(n)
+        if batch:
+            delete_queue_range(batch[0][0], batch[-1][0])
+    return [item for _, item in batch]
+
+def queue_find(product: str):
+    """O (seq, item) do produto na fila, ou None."""
+    row = get_connection().execute("SELECT seq, data FROM link_queue WHERE product = ?", (product,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else None
+
+def queue_bounds() -> tuple:
+    """Devolve (menor seq, maior seq) da fila, ou (None, None) se estiver vazia."""
+    return tuple(get_connection().execute("SELECT MIN(seq), MAX(seq) FROM link_queue").fetchone())
+
+def delete_queue_range(first_seq: int, last_seq: int) -> None:
+    """Remove da fila os itens com seq entre `first_seq` e `last_seq` (inclusive)."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM link_queue WHERE seq BETWEEN ? AND ?", (first_seq, last_seq))
+
+# --- REGISTO DE ENTREGAS ---
+# Última entrega com sucesso e última falha de cada utilizador; `unreachable_since` marca quem
+# bloqueou o bot ou apagou a conta, e é limpo na próxima entrega ou mensagem bem-sucedida.
+
+def record_delivery(user_id: int, ok: bool, at: float, reason: str = None, unreachable: bool = False) -> None:
+    with transaction() as conn:
+        if ok:
+            conn.execute(
+                "INSERT INTO deliveries (user_id, last_success) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET last_success = excluded.last_success, unreachable_since = NULL",
+                (user_id, at)
+            )
+        else:
+            conn.execute(
+                "INSERT INTO deliveries (user_id, last_failure, failure_reason, unreachable_since) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET last_failure = excluded.last_failure, "
+                "failure_reason = excluded.failure_reason, "
+                "unreachable_since = COALESCE(deliveries.unreachable_since, excluded.unreachable_since)",
+                (user_id, at, reason, at if unreachable else None)
+            )
+
+def mark_user_reachable(user_id: int) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE deliveries SET unreachable_since = NULL WHERE user_id = ?", (user_id,))
+
+def load_unreachable_users() -> set:
+    return {row[0] for row in get_connection().execute("SELECT user_id FROM deliveries WHERE unreachable_since IS NOT NULL")}
+
+def unreachable_by_reason(since: float = 0) -> dict:
+    """Número de utilizadores inalcançáveis (desde `since`) por motivo."""
+    rows = get_connection().execute(
+        "SELECT failure_reason, COUNT(*) FROM deliveries WHERE unreachable_since >= ? GROUP BY failure_reason", (since,)
+    ).fetchall()
+    return dict(rows)
+
+# --- DADOS POR UTILIZADOR (user_data do Telegram, partilhado entre processos) ---
+
+def load_user_data(user_id: int):
+    row = get_connection().execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def load_all_user_data() -> dict:
+    return {uid: json.loads(data) for uid, data in get_connection().execute("SELECT user_id, data FROM user_data")}
+
+def save_user_data(user_id: int, data: dict) -> None:
+    with transaction() as conn:
+        if data:
+            conn.execute(
+                "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                (user_id, json.dumps(data, ensure_ascii=False))
+            )
+        else:
+            conn.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+# --- PEDIDOS DE SUPORTE ---
+# Estados de um pedido: 'open' (à espera de resposta), 'answered', 'closed'. Cada mensagem da conversa
+# (encaminhamentos para os admins e respostas) fica associada ao pedido por (chat_id, message_id).
+
+def open_support_ticket(user_id: int, preview: str, at: float) -> int:
+    """Devolve o pedido por fechar do utilizador (reaberto, à espera de resposta) ou cria um novo."""
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            "SELECT id FROM support_tickets WHERE user_id = ? AND status != 'closed' ORDER BY id DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        if row:
+            conn.execute(
+                "UPDATE support_tickets SET status = 'open', updated_at = ?, preview = ? WHERE id = ?", (at, preview, row[0])
+            )
+            return row[0]
+        cursor = conn.execute(
+            "INSERT INTO support_tickets (user_id, opened_at, updated_at, status, preview) VALUES (?, ?, ?, 'open', ?)",
+            (user_id, at, at, preview)
+        )
+        return cursor.lastrowid
+
+def link_support_message(ticket_id: int, chat_id: int, message_id: int) -> None:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO support_messages (chat_id, message_id, ticket_id) VALUES (?, ?, ?)",
+            (chat_id, message_id, ticket_id)
+        )
+
+def find_support_ticket(chat_id: int, message_id: int):
+    rows = _fetch_dicts(
+        "SELECT t.* FROM support_messages m JOIN support_tickets t ON t.id = m.ticket_id "
+        "WHERE m.chat_id = ? AND m.message_id = ?", (chat_id, message_id)
+    )
+    return rows[0] if rows else None
+
+def get_support_ticket(ticket_id: int):
+    rows = _fetch_dicts("SELECT * FROM support_tickets WHERE id = ?", (ticket_id,))
+    return rows[0] if rows else None
+
+def set_support_ticket_status(ticket_id: int, status: str, at: float) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE support_tickets SET status = ?, updated_at = ? WHERE id = ?", (status, at, ticket_id))
+
+def list_open_support_tickets(limit: int = 20) -> list:
+    """Pedidos por fechar, os que esperam resposta há mais tempo primeiro."""
+    return _fetch_dicts(
+        "SELECT * FROM support_tickets WHERE status != 'closed' "
+        "ORDER BY status = 'answered', updated_at LIMIT ?", (limit,)
+    )
+
+def prune_support_tickets(before: float) -> None:
+    """Esquece os pedidos sem atividade desde `before` e as mensagens associadas."""
+    with transaction() as conn:
+        conn.execute(
+            "DELETE FROM support_messages WHERE ticket_id IN (SELECT id FROM support_tickets WHERE updated_at < ?)", (before,)
+        )
+        conn.execute("DELETE FROM support_tickets WHERE updated_at < ?", (before,))
+
+# --- ATUALIZAÇÕES JÁ RECEBIDAS (IDEMPOTÊNCIA) ---
+
+def claim_update_id(update_id: int, received_at: float) -> bool:
+    """Regista um update_id; devolve False se já tinha sido registado (entrega repetida)."""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)", (update_id, received_at)
+        )
+    return cursor.rowcount == 1
+
+def load_recent_update_ids(since: float) -> list:
+    """Devolve (update_id, received_at) das atualizações recebidas depois de `since`, por ordem de chegada."""
+    return get_connection().execute(
+        "SELECT update_id, received_at FROM processed_updates WHERE received_at >= ? ORDER BY received_at", (since,)
+    ).fetchall()
+
+def prune_update_ids(before: float) -> None:
+    """Esquece as atualizações recebidas antes de `before`."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM processed_updates WHERE received_at < ?", (before,))
+
+# --- ENVIOS EM MASSA PERSISTENTES ---
+# Estados de um envio: 'preparing' (a acrescentar destinatários), 'running', 'paused', 'done'.
+# Estados de um destinatário: 'pending', 'sent', 'failed'.
+
+def create_broadcast_job(created_by: int, text: str, photo_id, owner: str, lease_seconds: float) -> int:
+    """Regista um novo envio em massa, ainda sem destinatários (estado 'preparing') e já reservado
+    para `owner`, e devolve o seu ID."""
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO broadcast_jobs (created_at, created_by, text, photo_id, status, total, owner, lease_until) "
+            "VALUES (?, ?, ?, ?, 'preparing', 0, ?, ?)",
+            (now, created_by, text, photo_id, owner, now + lease_seconds)
+        )
+    return cursor.lastrowid
+
+def last_broadcast_recipient(job_id: int) -> int:
+    """Maior ID já registado como destinatário do envio (-1 se ainda não houver nenhum)."""
+    row = get_connection().execute("SELECT MAX(user_id) FROM broadcast_recipients WHERE job_id = ?", (job_id,)).fetchone()
+    return row[0] if row[0] is not None else -1
+
+def add_broadcast_recipients(job_id: int, after_user_id: int, limit: int):
+    """Acrescenta ao envio os próximos `limit` utilizadores com ID maior que `after_user_id`.
+
+    Os utilizadores marcados como inalcançáveis no registo de entregas ficam de fora. Devolve o
+    último ID percorrido (o ponto de partida do bloco seguinte), ou None quando já não há mais.
+    """
+    with transaction() as conn:
+        last = conn.execute(
+            "SELECT MAX(user_id) FROM (SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?)",
+            (after_user_id, limit)
+        ).fetchone()[0]
+        if last is None:
+            return None
+        conn.execute(
+            "INSERT OR IGNORE INTO broadcast_recipients (job_id, user_id) SELECT ?, user_id FROM users "
+            "WHERE user_id > ? AND user_id <= ? AND user_id NOT IN "
+            "(SELECT user_id FROM deliveries WHERE unreachable_since IS NOT NULL)",
+            (job_id, after_user_id, last)
+        )
+    return last
+
+def start_broadcast_job(job_id: int) -> None:
+    """Fecha a lista de destinatários de um envio 'preparing' e passa-o a 'running'."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET status = 'running', "
+            "total = (SELECT COUNT(*) FROM broadcast_recipients WHERE job_id = ?) WHERE id = ?",
+            (job_id, job_id)
+        )
+
+def get_broadcast_job(job_id: int):
+    """Devolve um envio como dicionário, ou None se não existir."""
+    rows = _fetch_dicts("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,))
+    return rows[0] if rows else None
+
+def list_broadcast_jobs(limit: int = 10, status: str = None) -> list:
+    """Lista os envios mais recentes (opcionalmente filtrados por estado)."""
+    if status:
+        return _fetch_dicts("SELECT * FROM broadcast_jobs WHERE status = ? ORDER BY id DESC LIMIT ?", (status, limit))
+    return _fetch_dicts("SELECT * FROM broadcast_jobs ORDER BY id DESC LIMIT ?", (limit,))
+
+def pending_broadcast_recipients(job_id: int) -> list:
+    """Devolve, por ordem, os IDs que ainda não receberam o envio."""
+    rows = get_connection().execute(
+        "SELECT user_id FROM broadcast_recipients WHERE job_id = ? AND status = 'pending' ORDER BY user_id", (job_id,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def record_broadcast_result(job_id: int, user_id: int, ok: bool, error: str = None) -> None:
+    """Marca o resultado do envio para um destinatário e avança o cursor, numa só transação."""
+    with transaction() as conn:
+        changed = conn.execute(
+            "UPDATE broadcast_recipients SET status = ?, error = ? WHERE job_id = ? AND user_id = ? AND status = 'pending'",
+            ('sent' if ok else 'failed', error, job_id, user_id)
+        ).rowcount
+        if changed:
+            column = 'sent' if ok else 'failed'
+            conn.execute(
+                f"UPDATE broadcast_jobs SET {column} = {column} + 1, cursor = MAX(cursor, ?) WHERE id = ?",
+                (user_id, job_id)
+            )
+
+def set_broadcast_job_status(job_id: int, status: str) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE broadcast_jobs SET status = ? WHERE id = ?", (status, job_id))
+
+def set_broadcast_status_message(job_id: int, chat_id: int, message_id: int) -> None:
+    """Guarda a mensagem de progresso do admin, para que um envio retomado a continue a atualizar."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE broadcast_jobs SET status_chat_id = ?, status_message_id = ? WHERE id = ?",
+            (chat_id, message_id, job_id)
+        )
+
+def claim_broadcast_job(job_id: int, owner: str, lease_seconds: float) -> bool:
+    """Reserva (ou renova) a execução de um envio para `owner`; falha se outro processo o tiver reservado."""
+    now = time.time()
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE broadcast_jobs SET owner = ?, lease_until = ? WHERE id = ? AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+            (owner, now + lease_seconds, job_id, owner, now)
+        )
+    return cursor.rowcount == 1
+
+def release_broadcast_job(job_id: int, owner: str) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE broadcast_jobs SET owner = NULL, lease_until = 0 WHERE id = ? AND owner = ?", (job_id, owner))
@@ -0,0 +1,46 @@
+import time
+from collections import OrderedDict
+from database import claim_update_id, load_recent_update_ids, prune_update_ids
+
+class UpdateDeduplicator:
+    """Lembra os update_id recentes para que uma atualização reenviada pelo Telegram seja processada uma só vez.
+
+    A verificação é feita em memória (O(1)); cada update_id novo é também gravado na base de dados,
+    o que mantém a proteção depois de um reinício e entre vários processos.
+    """
+
+    def __init__(self, window: float, max_size: int):
+        self.window = window
+        self.max_size = max_size
+        self.duplicates = 0
+        self._seen = OrderedDict() # update_id -> instante de receção, por ordem de chegada
+        self._last_prune = time.time()
+
+    def load(self) -> None:
+        """Carrega os update_id recebidos dentro da janela (ex.: antes do último reinício)."""
+        for update_id, received_at in load_recent_update_ids(time.time() - self.window)[-self.max_size:]:
+            self._seen[update_id] = received_at
+
+    def claim(self, update_id: int) -> bool:
+        """Devolve True se a atualização é nova (e deve ser processada), False se é repetida."""
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        now = time.time()
+        if not claim_update_id(update_id, now):
+            # Já registada noutro processo ou antes de um reinício
+            self._seen[update_id] = now
+            self.duplicates += 1
+            return False
+        self._seen[update_id] = now
+        self._expire(now)
+        return True
+
+    def _expire(self, now: float) -> None:
+        """Remove da memória as entradas fora da janela ou em excesso e, de vez em quando, também do disco."""
+        cutoff = now - self.window
+        while self._seen and (len(self._seen) > self.max_size or next(iter(self._seen.values())) < cutoff):
+            self._seen.popitem(last=False)
+        if now - self._last_prune > min(self.window, 600):
+            prune_update_ids(cutoff)
+            self._last_prune = now
@@ -0,0 +1,74 @@
+import time
+from telegram.error import Forbidden, BadRequest
+from config import STATE_BACKEND
+from database import record_delivery, mark_user_reachable, load_unreachable_users
+from gravacao import write_behind
+
+# Motivos de falha definitiva (o utilizador deixa de receber envios em massa) e a sua descrição
+UNREACHABLE_REASONS = {
+    'blocked': "bloquearam o bot",
+    'deactivated': "apagaram a conta",
+    'chat_not_found': "chat não encontrado",
+    'forbidden': "outros bloqueios",
+}
+
+def unreachable_reason(error: Exception):
+    """Devolve o motivo se o erro indicar que o utilizador nunca mais poderá receber mensagens, ou None."""
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        if "blocked" in message:
+            return 'blocked'
+        if "deactivated" in message:
+            return 'deactivated'
+        return 'forbidden'
+    if isinstance(error, BadRequest) and "chat not found" in message:
+        return 'chat_not_found'
+    return None
+
+class DeliveryLedger:
+    """Registo, por utilizador, da última entrega com sucesso e da última falha (com o motivo).
+
+    Quem bloqueou o bot ou apagou a conta fica marcado como inalcançável e é excluído dos envios
+    em massa seguintes (ver add_broadcast_recipients). A marca desaparece na próxima entrega com sucesso
+    ou quando o utilizador volta a escrever ao bot. As gravações são feitas em grupo pelo write_behind.
+    """
+
+    def __init__(self, shared: bool):
+        self.shared = shared # True com STATE_BACKEND=sqlite (base de dados partilhada por vários workers)
+        self.unreachable = set() # utilizadores marcados como inalcançáveis (conhecidos por este processo)
+
+    def load(self) -> None:
+        self.unreachable = load_unreachable_users()
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self.unreachable
+
+    def record(self, user_id: int, error: Exception = None) -> bool:
+        """Regista o resultado de uma entrega; devolve True se o utilizador passou a estar inalcançável."""
+        now = time.time()
+        if error is None:
+            self.unreachable.discard(user_id)
+            write_behind.submit(record_delivery, user_id, True, now)
+            return False
+        reason = unreachable_reason(error)
+        if reason is None:
+            write_behind.submit(record_delivery, user_id, False, now, str(error)[:200])
+            return False
+        newly_unreachable = user_id not in self.unreachable
+        self.unreachable.add(user_id)
+        write_behind.submit(record_delivery, user_id, False, now, reason, True)
+        return newly_unreachable
+
+    def mark_reachable(self, user_id: int) -> None:
+        """O utilizador voltou a escrever ao bot: pode voltar a receber os envios em massa.
+
+        Com vários processos a marca pode ter sido gravada por outro worker depois de este ter
+        carregado o conjunto, por isso a base de dados é sempre atualizada (um UPDATE pela chave
+        primária que não faz nada se o utilizador não estiver marcado).
+        """
+        if user_id in self.unreachable or self.shared:
+            self.unreachable.discard(user_id)
+            write_behind.submit(mark_user_reachable, user_id)
+
+# Partilhado pelo /enviar e pelas notificações de vídeos (carregado em setup_bot)
+delivery_ledger = DeliveryLedger(STATE_BACKEND == "sqlite")
@@ -0,0 +1,164 @@
+import time
+from database import (
+    transaction, assign_video, delete_video, find_video, find_video_id, video_products, count_catalog,
+    has_user_id, count_user_ids, iter_user_ids,
+    load_link_queue, insert_queue_items, update_queue_item, delete_queue_range,
+    queue_length, queue_find, queue_bounds, claim_queue_head
+)
+from gravacao import write_behind
+
+# --- ESTADO PARTILHADO ENTRE PROCESSOS (STATE_BACKEND=sqlite) ---
+# Com vários workers do gunicorn cada processo tem a sua memória, por isso as cópias em memória
+# (VideoCatalog, LinkQueue, conjunto de utilizadores) deixariam de estar sincronizadas. Estas classes
+# têm a mesma interface mas leem e escrevem diretamente na base de dados SQLite (em modo WAL), que é
+# a única fonte de verdade. As sequências ler-depois-escrever usam transações IMMEDIATE.
+
+class SharedVideoCatalog:
+    """Catálogo de vídeos consultado diretamente na base de dados (mesma interface que VideoCatalog)."""
+
+    def __len__(self) -> int:
+        return count_catalog()[0]
+
+    def __contains__(self, product: str) -> bool:
+        return find_video(product) is not None
+
+    def __getitem__(self, product: str) -> str:
+        video_url = find_video(product)
+        if video_url is None:
+            raise KeyError(product)
+        return video_url
+
+    def get(self, product: str, default=None):
+        video_url = find_video(product)
+        return video_url if video_url is not None else default
+
+    @property
+    def video_count(self) -> int:
+        return count_catalog()[1]
+
+    def products_for(self, video_url: str) -> set:
+        return set(video_products(video_url))
+
+    def assign(self, products, video_url: str) -> None:
+        # Os vídeos que ficam sem produtos são calculados e removidos dentro da mesma transação
+        assign_video(products, video_url)
+
+    def delete_video(self, video_url: str) -> list:
+        with transaction(immediate=True):
+            video_id = find_video_id(video_url)
+            if video_id is None:
+                return []
+            products = video_products(video_url)
+            delete_video(video_id)
+        return products
+
+class SharedUserRegistry:
+    """Conjunto de IDs de utilizadores guardado na tabela users (mesma interface usada de um set)."""
+
+    def __len__(self) -> int:
+        return count_user_ids()
+
+    def __contains__(self, user_id: int) -> bool:
+        return write_behind.is_pending_user(user_id) or has_user_id(user_id)
+
+    def __iter__(self):
+        return iter_user_ids()
+
+    def add(self, user_id: int) -> None:
+        # Gravação em grupo; até lá os outros processos não o veem, mas registar de novo não tem efeito
+        write_behind.add_user(user_id)
+
+class SharedLinkQueue:
+    """Fila de links lida e alterada diretamente na tabela link_queue (mesma interface que LinkQueue).
+
+    Os itens devolvidos são cópias; `save_item` volta a ler o item dentro de uma transação e só
+    grava o resultado da conversão, para não apagar subscritores acrescentados por outro processo.
+    """
+
+    def __init__(self):
+        self._loaded = {} # chave do produto -> item devolvido por get/claim_for_conversion (para o save_item)
+
+    def __len__(self) -> int:
+        return queue_length()
+
+    def __iter__(self):
+        return (item for _, item in load_link_queue())
+
+    def __contains__(self, key: str) -> bool:
+        return queue_find(key) is not None
+
+    def get(self, key: str):
+        entry = queue_find(key)
+        if entry is None:
+            return None
+        self._loaded[key] = entry[1]
+        return entry[1]
+
+    def claim_for_conversion(self, key: str, lease_seconds: float):
+        """Reserva a conversão do item por `lease_seconds`; entre processos, só um converte cada produto."""
+        now = time.time()
+        with transaction(immediate=True):
+            entry = queue_find(key)
+            if entry is None:
+                return None
+            seq, item = entry
+            if 'converted_link' in item or item.get('converting_until', 0) > now:
+                return None
+            item['converting_until'] = now + lease_seconds
+            update_queue_item(seq, item)
+        self._loaded[key] = item
+        return item
+
+    def save_item(self, key: str) -> None:
+        item = self._loaded.pop(key, None)
+        if item is None:
+            return
+        with transaction(immediate=True):
+            entry = queue_find(key)
+            if entry is None:
+                return
+            seq, current = entry
+            for field in ('converted_link', 'conversion_error', 'converting_until'):
+                if field in item:
+                    current[field] = item[field]
+                else:
+                    current.pop(field, None)
+            update_queue_item(seq, current)
+
+    def append(self, item: dict) -> bool:
+        with transaction(immediate=True):
+            entry = queue_find(item['normalized_link'])
+            if entry is not None:
+                seq, existing = entry
+                subscribers = existing.setdefault('subscribers', [existing['user_id']])
+                if item['user_id'] not in subscribers:
+                    subscribers.append(item['user_id'])
+                    update_queue_item(seq, existing)
+                return False
+
+            item.setdefault('subscribers', [item['user_id']])
+            last_seq = queue_bounds()[1]
+            insert_queue_items([(last_seq + 1 if last_seq is not None else 0, item)])
+        return True
+
+    def pop_batch(self, n: int) -> list:
+        """Retira os primeiros `n` itens; entre processos, cada item só é entregue a um deles."""
+        items = claim_queue_head(n)
+        for item in items:
+            self._loaded.pop(item['normalized_link'], None)
+        return items
+
+    def push_front(self, items: list) -> None:
+        if not items:
+            return
+        with transaction(immediate=True):
+            for item in items:
+                duplicate = queue_find(item['normalized_link'])
+                if duplicate is not None:
+                    subscribers = item.setdefault('subscribers', [item['user_id']])
+                    existing = duplicate[1].get('subscribers') or [duplicate[1]['user_id']]
+                    subscribers.extend(uid for uid in existing if uid not in subscribers)
+                    delete_queue_range(duplicate[0], duplicate[0])
+            first_seq = queue_bounds()[0]
+            first_seq = first_seq if first_seq is not None else 0
+            insert_queue_items([(first_seq - len(items) + i, item) for i, item in enumerate(items)])
@@ -0,0 +1,45 @@
+import asyncio
+from config import FANOUT_CONCURRENCY
+from broadcast import send_with_retry
+from entregas import delivery_ledger
+
+class FanOutResult:
+    """Resultado de um envio para vários destinatários: quem recebeu e o erro de cada falha."""
+
+    def __init__(self):
+        self.delivered = []
+        self.errors = {} # chat_id -> exceção
+
+    @property
+    def sucesso(self) -> int:
+        return len(self.delivered)
+
+    @property
+    def falha(self) -> int:
+        return len(self.errors)
+
+async def fan_out(chat_ids, send, concurrency: int = FANOUT_CONCURRENCY, record_delivery: bool = False) -> FanOutResult:
+    """Envia para vários chats em paralelo (no máximo `concurrency` de cada vez).
+
+    `send(chat_id)` é a coroutine que faz o envio para um chat. Cada envio passa pelo limitador do
+    Telegram e é repetido em flood wait ou falha de rede (ver send_with_retry); o erro de um
+    destinatário não afeta os restantes. O tempo total fica próximo do envio mais lento, em vez
+    da soma de todos. Com `record_delivery`, o resultado fica no registo de entregas.
+    """
+    result = FanOutResult()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(chat_id):
+        async with semaphore:
+            try:
+                await send_with_retry(chat_id, send)
+                result.delivered.append(chat_id)
+                error = None
+            except Exception as e:
+                result.errors[chat_id] = e
+                error = e
+        if record_delivery:
+            delivery_ledger.record(chat_id, error)
+
+    await asyncio.gather(*(deliver(chat_id) for chat_id in dict.fromkeys(chat_ids)))
+    return result
@@ -0,0 +1,87 @@
+import asyncio
+from config import WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_MAX_DELAY
+from database import transaction, save_user_ids
+from metrics import storage_latency
+
+class WriteBehind:
+    """Gravação diferida com commit em grupo.
+
+    As alterações (utilizadores novos, operações no catálogo) ficam pendentes em memória e são
+    gravadas juntas numa só transação quando há `max_pending` pendentes ou passados `max_delay`
+    segundos desde a primeira, em vez de um commit por alteração. Ao desligar, `stop()` grava
+    tudo o que faltar. Em caso de falha abrupta do processo perdem-se no máximo `max_delay`
+    segundos de alterações.
+    """
+
+    def __init__(self, max_pending: int, max_delay: float):
+        self.max_pending = max_pending
+        self.max_delay = max_delay
+        self._users = set() # IDs de utilizadores por gravar
+        self._operations = [] # (função, argumentos) por gravar, pela ordem em que foram feitas
+        self._timer = None
+
+    def __len__(self) -> int:
+        return len(self._users) + len(self._operations)
+
+    def is_pending_user(self, user_id: int) -> bool:
+        return user_id in self._users
+
+    def pending_users(self) -> set:
+        """Cópia dos IDs de utilizadores ainda por gravar."""
+        return set(self._users)
+
+    def add_user(self, user_id: int) -> None:
+        """Marca um utilizador novo para ser gravado."""
+        self._users.add(user_id)
+        self._schedule()
+
+    def submit(self, operation, *args) -> None:
+        """Marca uma operação de escrita (ex.: assign_video) para ser executada no próximo commit."""
+        self._operations.append((operation, args))
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if len(self) >= self.max_pending:
+            self.flush()
+        elif self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+            except RuntimeError:
+                # Fora de um event loop (ex.: scripts): grava já
+                self.flush()
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self.flush()
+
+    def flush(self) -> None:
+        """Grava tudo o que estiver pendente numa única transação."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not len(self):
+            return
+        users, operations = self._users, self._operations
+        self._users, self._operations = set(), []
+        try:
+            with storage_latency.time("write_behind"), transaction():
+                save_user_ids(users)
+                for operation, args in operations:
+                    operation(*args)
+        except Exception as e:
+            # Nada foi gravado (a transação foi revertida): volta a ficar pendente para a próxima tentativa
+            print(f"Erro ao gravar {len(users)} utilizadores e {len(operations)} alterações do catálogo: {e}")
+            self._users |= users
+            self._operations[:0] = operations
+            if self._timer is None:
+                try:
+                    self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._on_timer)
+                except RuntimeError:
+                    pass
+
+    def stop(self) -> None:
+        """Grava o que faltar (usado ao desligar)."""
+        self.flush()
+
+# Partilhado pelo registo de utilizadores e pelo catálogo de vídeos
+write_behind = WriteBehind(WRITE_BEHIND_MAX_PENDING, WRITE_BEHIND_MAX_DELAY)
@@ -0,0 +1,106 @@
+from collections import deque
+from database import load_link_queue, insert_queue_items, update_queue_item, delete_queue_range
+
+def item_subscribers(item: dict) -> list:
+    """IDs de todos os utilizadores que submeteram o produto deste item."""
+    return item.get('subscribers') or [item['user_id']]
+
+class LinkQueue:
+    """Fila persistente de links submetidos pelos utilizadores.
+
+    Em memória é um deque de (seq, item); no disco cada item é uma linha da tabela link_queue.
+    Adicionar ao fim, retirar um lote do início e devolver itens ao início custam O(1) por item,
+    sem copiar a fila inteira. Um índice por produto faz com que submissões repetidas do mesmo
+    produto sejam juntadas no item já existente em vez de criarem um item novo.
+    """
+
+    def __init__(self, entries=()):
+        self._entries = deque(entries)
+        # chave do produto (normalized_link) -> (seq, item) presente na fila
+        self._by_key = {item['normalized_link']: (seq, item) for seq, item in self._entries}
+
+    @classmethod
+    def load(cls) -> 'LinkQueue':
+        """Carrega a fila guardada na base de dados."""
+        return cls(load_link_queue())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return (item for _, item in self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._by_key
+
+    def get(self, key: str):
+        """Devolve o item do produto com esta chave, ou None se não estiver na fila."""
+        entry = self._by_key.get(key)
+        return entry[1] if entry else None
+
+    def claim_for_conversion(self, key: str, lease_seconds: float):
+        """Devolve o item do produto `key` se ainda precisar de ser convertido, ou None.
+
+        Num só processo não há concorrência, por isso não é preciso reservar (ver SharedLinkQueue).
+        """
+        item = self.get(key)
+        return item if item is not None and 'converted_link' not in item else None
+
+    def save_item(self, key: str) -> None:
+        """Grava no disco as alterações feitas ao item do produto `key` (se ainda estiver na fila)."""
+        entry = self._by_key.get(key)
+        if entry is not None:
+            update_queue_item(*entry)
+
+    def append(self, item: dict) -> bool:
+        """Adiciona um item ao fim da fila.
+
+        Se o produto já estiver na fila, o utilizador é apenas acrescentado aos subscritores do
+        item existente. Devolve True se foi criado um item novo, False se foi juntado.
+        """
+        entry = self._by_key.get(item['normalized_link'])
+        if entry is not None:
+            seq, existing = entry
+            subscribers = existing.setdefault('subscribers', [existing['user_id']])
+            if item['user_id'] not in subscribers:
+                subscribers.append(item['user_id'])
+                update_queue_item(seq, existing)
+            return False
+
+        item.setdefault('subscribers', [item['user_id']])
+        seq = self._entries[-1][0] + 1 if self._entries else 0
+        insert_queue_items([(seq, item)])
+        self._entries.append((seq, item))
+        self._by_key[item['normalized_link']] = (seq, item)
+        return True
+
+    def pop_batch(self, n: int) -> list:
+        """Remove e devolve os primeiros `n` itens da fila."""
+        n = min(n, len(self._entries))
+        if n == 0:
+            return []
+        batch = [self._entries.popleft() for _ in range(n)]
+        delete_queue_range(batch[0][0], batch[-1][0])
+        for _, item in batch:
+            self._by_key.pop(item['normalized_link'], None)
+        return [item for _, item in batch]
+
+    def push_front(self, items: list) -> None:
+        """Devolve itens ao início da fila, mantendo a ordem entre eles (usado pelo /cancelar)."""
+        if not items:
+            return
+        for item in items:
+            # Raro: o produto voltou a ser submetido enquanto estava fora da fila. Os novos
+            # subscritores passam para o item devolvido e o item repetido é removido.
+            duplicate = self._by_key.pop(item['normalized_link'], None)
+            if duplicate is not None:
+                subscribers = item.setdefault('subscribers', [item['user_id']])
+                subscribers.extend(uid for uid in item_subscribers(duplicate[1]) if uid not in subscribers)
+                self._entries.remove(duplicate)
+                delete_queue_range(duplicate[0], duplicate[0])
+        first_seq = self._entries[0][0] if self._entries else 0
+        entries = [(first_seq - len(items) + i, item) for i, item in enumerate(items)]
+        insert_queue_items(entries)
+        self._entries.extendleft(reversed(entries))
+        for seq, item in entries:
+            self._by_key[item['normalized_link']] = (seq, item)
@@ -0,0 +1,175 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from telegram.request import HTTPXRequest
+
+# --- MÉTRICAS (FORMATO DE TEXTO DO PROMETHEUS) ---
+# Contadores e histogramas simples em memória, expostos em /metrics. Registar uma medição custa
+# uma procura binária e duas somas, por isso pode ser feito em cada pedido sem custo visível.
+# Com vários workers do gunicorn, cada processo expõe apenas as suas próprias métricas.
+
+# Limites (segundos) dos histogramas de latência
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Contador que só aumenta, opcionalmente com etiquetas (labels)."""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def total(self) -> float:
+        """Soma de todas as séries do contador."""
+        return sum(self._values.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+class Gauge:
+    """Valor instantâneo lido no momento da recolha; `collect()` devolve {valores das etiquetas: valor}."""
+
+    def __init__(self, name: str, help_text: str, collect, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._collect = collect
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self._collect()
+        except Exception as e:
+            print(f"Erro ao recolher a métrica {self.name}: {e}")
+            return lines
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Histograma de latências com limites fixos (contagens por intervalo, soma e total)."""
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {} # valores das etiquetas -> [contagens por intervalo (+Inf no fim), soma]
+
+    def observe(self, value: float, *label_values) -> None:
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+_registry = []
+
+def _register(metric):
+    # Registar de novo o mesmo nome (ex.: o bot foi configurado outra vez) substitui a métrica anterior
+    _registry[:] = [m for m in _registry if m.name != metric.name]
+    _registry.append(metric)
+    return metric
+
+def register_gauge(name: str, help_text: str, collect, labels=()) -> Gauge:
+    return _register(Gauge(name, help_text, collect, labels))
+
+def render_metrics() -> str:
+    """Todas as métricas no formato de texto do Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- MÉTRICAS DO BOT ---
+
+handler_latency = _register(Histogram(
+    "bot_handler_seconds", "Duração de cada handler do Telegram.", ("handler",)))
+handler_errors = _register(Counter(
+    "bot_handler_errors_total", "Exceções não tratadas nos handlers.", ("handler",)))
+update_latency = _register(Histogram(
+    "bot_update_seconds", "Duração do processamento completo de uma atualização."))
+webhook_requests = _register(Counter(
+    "bot_webhook_requests_total", "Pedidos recebidos no webhook, por resultado.", ("result",)))
+shopee_latency = _register(Histogram(
+    "bot_shopee_request_seconds", "Duração dos pedidos HTTP à Shopee.", ("operation",)))
+shopee_errors = _register(Counter(
+    "bot_shopee_errors_total", "Pedidos à Shopee que falharam ou foram rejeitados.", ("operation",)))
+telegram_latency = _register(Histogram(
+    "bot_telegram_request_seconds", "Duração dos pedidos à API do Telegram.", ("method",)))
+telegram_errors = _register(Counter(
+    "bot_telegram_errors_total", "Pedidos ao Telegram com erro (HTTP >= 400 ou falha de rede).", ("method",)))
+storage_latency = _register(Histogram(
+    "bot_storage_seconds", "Duração das gravações em ficheiro.", ("operation",)))
+broadcast_messages = _register(Counter(
+    "bot_broadcast_messages_total", "Mensagens de envios em massa, por resultado.", ("result",)))
+submissions_rejected = _register(Counter(
+    "bot_submissions_rejected_total", "Mensagens de utilizadores recusadas por limite ou excesso de carga.", ("reason",)))
+
+def timed_handler(callback):
+    """Envolve um handler do Telegram para medir a duração e contar as exceções."""
+    name = callback.__name__
+
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que mede a duração e os erros de cada método da API do Telegram."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            telegram_errors.inc(api_method)
+            raise
+        finally:
+            telegram_latency.observe(time.perf_counter() - started, api_method)
+        if code >= 400:
+            telegram_errors.inc(api_method)
+        return code, payload
@@ -0,0 +1,69 @@
+from telegram.ext import BasePersistence, PersistenceInput
+from database import load_user_data, load_all_user_data, save_user_data
+
+class SQLitePersistence(BasePersistence):
+    """Guarda o context.user_data na base de dados SQLite, para ser partilhado entre processos.
+
+    Só o user_data é persistido: é aí que fica o estado dos fluxos de admin (/add<N> seguido de
+    /video, /addmanual, ...), e esses comandos podem ser atendidos por workers diferentes.
+    Antes de cada atualização o user_data do utilizador é recarregado da base de dados.
+    """
+
+    def __init__(self, update_interval: float = 60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+
+    async def get_user_data(self) -> dict:
+        return load_all_user_data()
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        save_user_data(user_id, data)
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        stored = load_user_data(user_id)
+        user_data.clear()
+        if stored:
+            user_data.update(stored)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        save_user_data(user_id, {})
+
+    # --- Dados não persistidos ---
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def flush(self) -> None:
+        pass
@@ -0,0 +1,74 @@
+import asyncio
+from collections import deque
+
+class UpdatePipeline:
+    """Processa as atualizações do Telegram num conjunto de workers, mantendo a ordem por chat.
+
+    As atualizações de chats diferentes são processadas em paralelo (até `workers` de cada vez);
+    as do mesmo chat são processadas uma de cada vez, pela ordem em que chegaram.
+    """
+
+    def __init__(self, process, workers: int):
+        self._process = process
+        self._worker_count = workers
+        self._queues = {} # chave do chat -> deque de atualizações ainda por processar
+        self._ready = None # asyncio.Queue de chaves de chats com trabalho pendente
+        self._workers = []
+
+    def __len__(self) -> int:
+        """Número de atualizações à espera de processamento."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self) -> None:
+        """Arranca os workers no event loop atual."""
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._worker_count)]
+
+    def submit(self, key, update) -> None:
+        """Põe uma atualização na fila do seu chat, sem esperar pelo processamento."""
+        queue = self._queues.get(key)
+        if queue is None:
+            # O chat não tinha trabalho: fica pronto para o próximo worker livre
+            self._queues[key] = deque([update])
+            self._ready.put_nowait(key)
+        else:
+            # O chat já está na fila ou a ser processado; o worker atual volta a agendá-lo
+            queue.append(update)
+
+    async def _worker(self) -> None:
+        while True:
+            key = await self._ready.get()
+            queue = self._queues[key]
+            update = queue.popleft()
+            try:
+                await self._process(update)
+            except Exception as e:
+                print(f"Erro ao processar a atualização {getattr(update, 'update_id', '?')}: {e}")
+            finally:
+                # Uma atualização por vez: se o chat tiver mais, volta para o fim da fila (justiça entre chats)
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._queues[key]
+                self._ready.task_done()
+
+    async def join(self) -> None:
+        """Espera até não haver atualizações pendentes nem em processamento."""
+        await self._ready.join()
+
+    async def stop(self, timeout: float) -> None:
+        """Espera (até `timeout` segundos) que as atualizações pendentes sejam processadas e para os workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"AVISO: {len(self)} atualizações ficaram por processar ao desligar.")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,86 @@
+import asyncio
+from collections import deque
+from api_shopee import convert_shopee_links
+from config import SHOPEE_BATCH_SIZE, PRECONVERT_CONCURRENCY, PRECONVERT_CLAIM_TTL
+
+class PreConverter:
+    """Converte em segundo plano os links da fila em links de afiliado, antes de o admin usar /add<N>.
+
+    O resultado fica no próprio item da fila ('converted_link' ou, em caso de falha,
+    'conversion_error'), por isso o /add<N> responde logo com os links já convertidos e os
+    produtos com problemas aparecem assinalados na fila.
+
+    A conversão corre numa tarefa asyncio própria (ver `wake()`), fora das tarefas do Application:
+    o Application.stop() esperaria por ela, e com uma fila grande o bot demoraria minutos a
+    desligar. `stop()` cancela-a; o que ficar por converter é retomado no próximo arranque.
+    """
+
+    def __init__(self, link_queue):
+        self.link_queue = link_queue
+        self._pending = deque() # chaves de produtos à espera de conversão
+        self._running = False
+        self._stopped = False
+        self._task = None
+        for item in link_queue:
+            if 'converted_link' not in item and 'conversion_error' not in item:
+                self._pending.append(item['normalized_link'])
+
+    def schedule(self, key: str) -> None:
+        """Marca o produto `key` da fila para conversão."""
+        self._pending.append(key)
+
+    def wake(self) -> None:
+        """Arranca a conversão em segundo plano, se ainda não estiver a decorrer."""
+        if not self._stopped and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        """Para a conversão em curso (usado ao desligar)."""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+
+    def _next_chunk(self) -> list:
+        """Retira da lista de espera até SHOPEE_BATCH_SIZE itens que ainda precisam de conversão.
+
+        Com vários workers todos veem a mesma fila; a reserva faz com que cada item só seja
+        convertido por um deles.
+        """
+        chunk = {}
+        while self._pending and len(chunk) < SHOPEE_BATCH_SIZE:
+            key = self._pending.popleft()
+            if key in chunk:
+                continue
+            item = self.link_queue.claim_for_conversion(key, PRECONVERT_CLAIM_TTL)
+            if item is not None:
+                chunk[key] = item
+        return list(chunk.values())
+
+    async def _convert_chunk(self, chunk: list) -> None:
+        results = await convert_shopee_links([item['original_link'] for item in chunk])
+        for item, result in zip(chunk, results):
+            item.pop('converting_until', None)
+            if "Erro" in result:
+                item['conversion_error'] = result
+            else:
+                item['converted_link'] = result
+                item.pop('conversion_error', None)
+            self.link_queue.save_item(item['normalized_link'])
+
+    async def run(self) -> None:
+        """Converte tudo o que estiver à espera, com no máximo PRECONVERT_CONCURRENCY pedidos em paralelo.
+
+        Se já houver uma execução em curso, não faz nada: essa execução apanha os itens novos.
+        """
+        if self._running:
+            return
+        self._running = True
+        try:
+            while self._pending:
+                chunks = [chunk for chunk in (self._next_chunk() for _ in range(PRECONVERT_CONCURRENCY)) if chunk]
+                if chunks:
+                    await asyncio.gather(*(self._convert_chunk(chunk) for chunk in chunks))
+        except Exception as e:
+            print(f"Erro na pré-conversão da fila: {e}")
+        finally:
+            self._running = False
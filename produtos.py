@@ -0,0 +1,32 @@
+import re
+
+# --- IDENTIFICAÇÃO CANÓNICA DE PRODUTOS ---
+# O mesmo produto da Shopee aparece com vários formatos de URL; todos contêm o par (shop_id, item_id).
+# Os padrões estão por ordem de especificidade e são compilados uma única vez.
+PRODUCT_URL_PATTERNS = [
+    # https://shopee.com.br/Nome-do-Produto-i.<shop>.<item> e links affiliation-i.<shop>.<item>
+    re.compile(r'-i\.(\d+)\.(\d+)', re.IGNORECASE),
+    # https://shopee.com.br/product/<shop>/<item>
+    re.compile(r'/product/(\d+)/(\d+)', re.IGNORECASE),
+    # ...?shopid=<shop>&itemid=<item> (também shop_id/item_id)
+    re.compile(r'[?&]shop_?id=(\d+)(?:&[^#]*?)?[?&]item_?id=(\d+)', re.IGNORECASE),
+    # https://shopee.com.br/<loja ou prefixo>/<shop>/<item>
+    re.compile(r'/[\w.-]+/(\d+)/(\d+)(?:[/?#]|$)'),
+]
+
+def parse_product_ids(url: str):
+    """Extrai (shop_id, item_id) de um URL de produto da Shopee, ou None se não for reconhecido."""
+    for pattern in PRODUCT_URL_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    return None
+
+def product_key(url: str):
+    """Chave canónica de um produto ("<shop_id>.<item_id>"), ou None se o URL não tiver os IDs."""
+    ids = parse_product_ids(url)
+    return f"{ids[0]}.{ids[1]}" if ids else None
+
+def product_key_or_url(url: str) -> str:
+    """Chave canónica do produto; se os IDs não forem encontrados, o URL sem parâmetros (comportamento antigo)."""
+    return product_key(url) or url.split('?')[0]
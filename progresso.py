@@ -0,0 +1,85 @@
+import asyncio
+import time
+from telegram.constants import MessageLimit
+from broadcast import send_with_retry
+
+class LiveStatus:
+    """Mensagem de estado atualizada no lugar à medida que o trabalho avança (ex.: /add <N>).
+
+    O texto é uma linha de cabeçalho seguida de uma linha por item. Se não couber numa mensagem
+    (MAX_TEXT_LENGTH, 4096 caracteres), continua em mensagens seguintes, e cada página é editada
+    só quando o seu texto muda. As alterações são agrupadas: no máximo uma atualização a cada
+    `min_interval` segundos, e os envios passam pelo limitador do Telegram (ver send_with_retry).
+    """
+
+    def __init__(self, message, header: str, lines: list, min_interval: float):
+        self.message = message # mensagem do admin à qual as páginas respondem
+        self.header = header
+        self.lines = list(lines)
+        self.min_interval = min_interval
+        self._pages = [] # mensagens já enviadas, uma por página
+        self._texts = [] # último texto enviado em cada página
+        self._last_render = 0.0
+        self._render_task = None
+        self._lock = asyncio.Lock()
+
+    def set_header(self, header: str) -> None:
+        self.header = header
+        self._schedule()
+
+    def set_line(self, i: int, text: str) -> None:
+        """Altera a linha do item `i` e agenda uma atualização."""
+        self.lines[i] = text
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._render_task is None:
+            self._render_task = asyncio.create_task(self._render_later())
+
+    async def _render_later(self) -> None:
+        await asyncio.sleep(max(0.0, self._last_render + self.min_interval - time.monotonic()))
+        self._render_task = None
+        await self.render()
+
+    async def finish(self, header: str = None) -> None:
+        """Espera pela atualização agendada e mostra o estado final."""
+        if header is not None:
+            self.header = header
+        if self._render_task is not None:
+            await self._render_task
+        await self.render()
+
+    def _paginate(self) -> list:
+        limit = MessageLimit.MAX_TEXT_LENGTH
+        pages, current = [], self.header
+        for line in self.lines:
+            line = line[:limit]
+            if len(current) + 1 + len(line) > limit:
+                pages.append(current)
+                current = line
+            else:
+                current = f"{current}\n{line}" if current else line
+        pages.append(current)
+        return pages
+
+    async def render(self) -> None:
+        async with self._lock:
+            self._last_render = time.monotonic()
+            chat_id = self.message.chat_id
+            for i, text in enumerate(self._paginate()):
+                try:
+                    if i == len(self._pages):
+                        sent = []
+                        await send_with_retry(chat_id, lambda _: self._reply(text, sent))
+                        self._pages.append(sent[0])
+                        self._texts.append(text)
+                    elif self._texts[i] != text:
+                        await send_with_retry(chat_id, lambda _: self._pages[i].edit_text(text, disable_web_page_preview=True))
+                        self._texts[i] = text
+                except Exception as e:
+                    # Uma página por atualizar fica para a próxima atualização
+                    print(f"Falha ao atualizar a mensagem de estado (página {i + 1}): {e}")
+                    return
+
+    async def _reply(self, text: str, sent: list) -> None:
+        sent.append(await self.message.reply_text(text, disable_web_page_preview=True))
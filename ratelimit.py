@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """Balde de fichas (token bucket): permite `rate` operações por segundo com picos até `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Consome fichas se estiverem disponíveis agora; devolve False sem esperar caso contrário."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Espera até haver fichas disponíveis (e até terminar qualquer pausa) e consome-as."""
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Suspende o balde durante `seconds` (ex.: quando o Telegram responde com RetryAfter)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+class TelegramRateLimiter:
+    """Limitador com os limites do Telegram: um balde global e um intervalo mínimo por chat."""
+
+    def __init__(self, global_rate: float, per_chat_interval: float):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self._next_allowed = {} # chat_id -> instante (monotonic) a partir do qual se pode voltar a enviar
+
+    async def acquire(self, chat_id: int) -> None:
+        """Espera pela vez do chat e depois por uma ficha do balde global."""
+        now = time.monotonic()
+        wait = self._next_allowed.get(chat_id, 0.0) - now
+        self._next_allowed[chat_id] = max(now, now + wait) + self.per_chat_interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.global_bucket.acquire()
+        if len(self._next_allowed) > 10000:
+            self._evict(time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        self.global_bucket.pause(seconds)
+
+    def _evict(self, now: float) -> None:
+        """Remove os chats cujo intervalo já passou, para a memória não crescer sem limite."""
+        self._next_allowed = {chat_id: t for chat_id, t in self._next_allowed.items() if t > now}
+
+class SubmissionLimiter:
+    """Limita as mensagens dos utilizadores (submissões e suporte): um balde por utilizador e um global.
+
+    Um balde parado tempo suficiente volta a ficar cheio, o que é o mesmo que não existir, por isso
+    os baldes inativos são removidos de `evict_interval` em `evict_interval` segundos e a memória
+    fica proporcional aos utilizadores ativos. O estado é só deste processo: com vários workers
+    cada um aplica os seus próprios limites.
+    """
+
+    def __init__(self, user_rate: float, user_capacity: float, global_rate: float, global_capacity: float,
+                 evict_interval: float = 300):
+        self.user_rate = user_rate
+        self.user_capacity = user_capacity
+        self.global_bucket = TokenBucket(global_rate, global_capacity)
+        self.evict_interval = evict_interval
+        self._buckets = {} # user_id -> TokenBucket
+        self._warned = set() # utilizadores já avisados do limite desde a última mensagem aceite
+        self._last_evict = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def check(self, user_id: int, cost: float = 1):
+        """Consome `cost` fichas do utilizador e do balde global.
+
+        Devolve None se a mensagem pode ser processada, ou o limite atingido ('user' ou 'global').
+        O custo é limitado à capacidade do balde, para uma mensagem grande continuar a ser possível.
+        """
+        now = time.monotonic()
+        if now - self._last_evict > self.evict_interval:
+            self._evict(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_capacity)
+        cost = min(cost, self.user_capacity, self.global_bucket.capacity)
+        if not bucket.try_acquire(cost):
+            return 'user'
+        if not self.global_bucket.try_acquire(cost):
+            # Não foi processada: o utilizador não perde as fichas
+            bucket.tokens += cost
+            return 'global'
+        self._warned.discard(user_id)
+        return None
+
+    def should_warn(self, user_id: int) -> bool:
+        """True só na primeira mensagem recusada de uma sequência, para não responder a cada uma."""
+        if user_id in self._warned:
+            return False
+        self._warned.add(user_id)
+        return True
+
+    def retry_after(self, user_id: int) -> float:
+        """Segundos até o utilizador voltar a ter pelo menos uma ficha."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            return 0.0
+        tokens = bucket.tokens + (time.monotonic() - bucket.updated_at) * bucket.rate
+        return max(0.0, (1 - tokens) / bucket.rate)
+
+    def _evict(self, now: float) -> None:
+        """Remove os baldes que, entretanto, já voltaram a encher."""
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if bucket.tokens + (now - bucket.updated_at) * bucket.rate < bucket.capacity
+        }
+        self._warned &= self._buckets.keys()
+        self._last_evict = now
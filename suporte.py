@@ -0,0 +1,54 @@
+import time
+from config import SUPPORT_TICKET_RETENTION
+from database import (
+    open_support_ticket, link_support_message, find_support_ticket, get_support_ticket,
+    set_support_ticket_status, list_open_support_tickets, prune_support_tickets
+)
+
+class SupportTickets:
+    """Pedidos de suporte e as mensagens de cada conversa.
+
+    Cada mensagem encaminhada aos admins fica registada no momento do envio como
+    (chat do admin, message_id) -> pedido, e o mesmo acontece com as respostas dos admins. Responder
+    a qualquer mensagem da conversa encontra o utilizador com uma só consulta pela chave primária,
+    sem depender do texto da mensagem. As mensagens seguintes do utilizador juntam-se ao pedido que
+    ainda estiver por fechar. Os pedidos sem atividade há mais de `retention` segundos são esquecidos.
+    """
+
+    def __init__(self, retention: float):
+        self.retention = retention
+        self._last_prune = 0.0
+
+    def open(self, user_id: int, text: str) -> int:
+        """Regista uma mensagem de suporte do utilizador e devolve o ID do pedido."""
+        now = time.time()
+        self._expire(now)
+        return open_support_ticket(user_id, text[:100], now)
+
+    def link(self, ticket_id: int, chat_id: int, message_id: int) -> None:
+        """Associa uma mensagem enviada (ou recebida) num chat de admin ao pedido."""
+        link_support_message(ticket_id, chat_id, message_id)
+
+    def find(self, chat_id: int, message_id: int):
+        """Devolve o pedido a que pertence a mensagem, ou None se não for de suporte (ou já tiver expirado)."""
+        return find_support_ticket(chat_id, message_id)
+
+    def get(self, ticket_id: int):
+        return get_support_ticket(ticket_id)
+
+    def mark_answered(self, ticket_id: int) -> None:
+        set_support_ticket_status(ticket_id, 'answered', time.time())
+
+    def close(self, ticket_id: int) -> None:
+        set_support_ticket_status(ticket_id, 'closed', time.time())
+
+    def list_open(self, limit: int = 20) -> list:
+        return list_open_support_tickets(limit)
+
+    def _expire(self, now: float) -> None:
+        if now - self._last_prune > min(self.retention, 3600):
+            prune_support_tickets(now - self.retention)
+            self._last_prune = now
+
+# Partilhado pelos handlers de utilizadores (abertura) e de admins (respostas)
+support_tickets = SupportTickets(SUPPORT_TICKET_RETENTION)
@@ -0,0 +1,127 @@
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from config import USER_SNAPSHOT_FILE
+from database import iter_user_ids, max_user_seq, user_ids_since, count_user_ids
+from gravacao import write_behind
+
+# Cabeçalho do snapshot: assinatura, versão, número de IDs, último seq incluído
+SNAPSHOT_MAGIC = b"UIDS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sIQQ")
+
+class UserRegistry:
+    """Conjunto compacto de IDs de utilizadores registados, em memória.
+
+    Os IDs ficam num array ordenado de int64 (8 bytes por utilizador, contra dezenas de bytes de
+    um int num set) mais um pequeno buffer de inserções recentes, que é fundido no array quando
+    passa de `buffer_size`. A pesquisa é binária no array e O(1) no buffer.
+
+    A gravação dos utilizadores novos na base de dados é feita em grupo pelo write_behind. Ao
+    desligar, o array é escrito num snapshot binário (user_ids.bin) com o número de registo (seq)
+    do último utilizador incluído; ao arrancar, o snapshot é lido de uma só vez e só os
+    utilizadores registados depois dele são lidos da base de dados.
+    """
+
+    def __init__(self, sorted_ids: array = None, watermark: int = 0, buffer_size: int = 65536):
+        self._sorted = sorted_ids if sorted_ids is not None else array('q')
+        self._buffer = set()
+        self.buffer_size = buffer_size
+        self.watermark = watermark # seq do último utilizador da base de dados já incluído
+
+    @classmethod
+    def load(cls, path: str = USER_SNAPSHOT_FILE) -> 'UserRegistry':
+        """Carrega o snapshot (se existir e estiver válido) e acrescenta os utilizadores registados depois dele."""
+        registry = cls._read_snapshot(path)
+        if registry is not None:
+            new_ids, registry.watermark = user_ids_since(registry.watermark)
+            for user_id in new_ids:
+                registry._insert(user_id)
+            if len(registry) == count_user_ids():
+                return registry
+            print("AVISO: O snapshot de utilizadores não coincide com a base de dados; a recarregar.")
+
+        # Sem snapshot válido: leitura completa, já por ordem crescente de ID
+        watermark = max_user_seq()
+        registry = cls(array('q', iter_user_ids()), watermark)
+        registry.save(path)
+        return registry
+
+    @classmethod
+    def _read_snapshot(cls, path: str):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < SNAPSHOT_HEADER.size:
+            return None
+        magic, version, count, watermark = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or len(data) != SNAPSHOT_HEADER.size + count * 8:
+            return None
+        sorted_ids = array('q')
+        sorted_ids.frombytes(data[SNAPSHOT_HEADER.size:])
+        if sys.byteorder != 'little':
+            sorted_ids.byteswap()
+        return cls(sorted_ids, watermark)
+
+    def save(self, path: str = USER_SNAPSHOT_FILE) -> None:
+        """Escreve o snapshot binário de forma atómica (ficheiro temporário + rename).
+
+        Só inclui utilizadores já gravados na base de dados, para o seq do cabeçalho ser exato: os
+        que o write_behind ainda tem por gravar ficam de fora e, depois de gravados, são lidos da
+        base de dados no próximo arranque. Deve ser chamado depois de o write_behind gravar os pendentes.
+        """
+        new_ids, self.watermark = user_ids_since(self.watermark)
+        for user_id in new_ids:
+            self._insert(user_id)
+        self._merge_buffer()
+        snapshot = self._sorted
+        # Um pendente pode já ter sido gravado por outro processo (e vir em new_ids)
+        pending = write_behind.pending_users().difference(new_ids)
+        if pending:
+            snapshot = array('q', (user_id for user_id in snapshot if user_id not in pending))
+        elif sys.byteorder != 'little':
+            snapshot = array('q', snapshot)
+        if sys.byteorder != 'little':
+            snapshot.byteswap()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(snapshot), self.watermark))
+            f.write(snapshot.tobytes())
+        os.replace(tmp_path, path)
+
+    def _in_sorted(self, user_id: int) -> bool:
+        i = bisect_left(self._sorted, user_id)
+        return i < len(self._sorted) and self._sorted[i] == user_id
+
+    def _insert(self, user_id: int) -> bool:
+        if user_id in self._buffer or self._in_sorted(user_id):
+            return False
+        self._buffer.add(user_id)
+        if len(self._buffer) >= self.buffer_size:
+            self._merge_buffer()
+        return True
+
+    def _merge_buffer(self) -> None:
+        if self._buffer:
+            self._sorted = array('q', merge(self._sorted, sorted(self._buffer)))
+            self._buffer = set()
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._buffer)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._buffer or self._in_sorted(user_id)
+
+    def __iter__(self):
+        # Cópia do buffer: o envio em massa percorre a lista enquanto chegam utilizadores novos
+        yield from self._sorted
+        yield from list(self._buffer)
+
+    def add(self, user_id: int) -> None:
+        if self._insert(user_id):
+            write_behind.add_user(user_id)